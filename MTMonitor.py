@@ -11,21 +11,23 @@
 #python_version  :2.7
 #==============================================================================
 
-import random
+import math
 import time
 import os
+import re
 import json
+import threading
 from datetime import datetime
-import requests
 from requests.compat import urljoin
-from pyproj import Proj, transform
-import shapely
-from shapely.geometry import Polygon
-from shapely.geometry import Point
-from shapely.geometry import mapping
-import fiona
-from fiona.crs import from_epsg
-from MT_NGW_init_schemes import MT_NGW_init_schemes
+from MT_vessel_registry import MT_vessel_registry
+from MT_transport import MT_transport
+from MT_transform import MT_transform
+from MT_logger import MT_logger
+from MT_vessel import MT_vessel
+from MT_stream_parser import MT_stream_parser
+from MT_metrics import MT_metrics, MT_metrics_server
+# Geometry (shapely), Fiona, NGW, scheduling and emulation modules are imported on first use,
+# so polling without areas or file export doesn't pay for their import
 
 class MTMonitor():
 
@@ -34,10 +36,41 @@ class MTMonitor():
     default_time_period = 5 # In minutes
     default_run_period = 5  # In minutes
     monitoring_areas = []
+    area_index = None
+    # Areas and index over them published together, see set_monitoring_areas
+    monitoring_areas_with_index = ([], None)
+    area_loader = None
+    reload_areas = True
+    request_coalescer = None
+    vectorized_filtering = True
+    max_concurrent_requests = 4
+    min_request_interval = 0 # In seconds
     last_vessels_response = []
+    last_area_errors = {}
+    last_NGW_errors = []
+    scheduler = None
+    NGW_sync_state = {}
     log_file = 'log.txt'
-
-    def __init__(self, MT_API_Key, mode='Predefined', monitoring_area_source=None, log_file=None):
+    log_level = 'INFO'
+    stream_responses = True
+    response_protocol = 'jsono'
+    deduplicate_positions = False
+    adaptive_time_period = False
+    min_time_period = 2     # In minutes
+    time_period_margin = 1  # In minutes
+    last_successful_poll_time = None
+    emulation_vessels = 10
+    emulation_seed = None
+    traffic_simulator = None
+    metrics = None
+    metrics_server = None
+
+    def __init__(self, MT_API_Key, mode='Predefined', monitoring_area_source=None, log_file=None, vectorized_filtering=True,
+                 vessel_registry_ttl=None, vessel_registry_file=None, max_concurrent_requests=None, min_request_interval=None,
+                 transport=None, log_level=None, stream_responses=True, response_protocol='jsono',
+                 deduplicate_positions=False, adaptive_time_period=False, emulation_vessels=None, emulation_seed=None,
+                 metrics=None, metrics_port=None, area_simplify_tolerance=None, area_cache_dir=None, reload_areas=True,
+                 request_coalescer=None):
         """
         Class initialization.
         Inputs are MarineTraffic API Key, mode and (optionally) OGR source with region of interest
@@ -55,6 +88,38 @@ class MTMonitor():
         Allowed any SRS with epsg code.
 
         If monitoring area OGR source specified, all vessels will be filtered by it.
+        With vectorized_filtering whole response is filtered in one batch call (needs shapely 2 and NumPy,
+        otherwise vessels are checked one by one).
+
+        Vessels are remembered in registry for vessel_registry_ttl minutes after last sighting. Vessel is marked as NEW
+        only if it is absent in registry. If vessel_registry_file specified, registry is saved to it and restored on start.
+
+        In Custom mode areas are requested in parallel, at most max_concurrent_requests at once and not more often
+        than once per min_request_interval seconds (to stay within MarineTraffic rate limits).
+
+        With stream_responses MarineTraffic responses are parsed incrementally while they are downloaded,
+        and every vessel goes to area filtering right away, so vessels outside areas are never collected.
+        response_protocol is 'jsono' or 'csv'.
+
+        With deduplicate_positions get_vessels returns only positions not returned by previous polls: vessel whose
+        TIMESTAMP is the same as remembered in registry is dropped. It is intended for append modes, history and tracks,
+        but not for rewrite and sync modes, which need all vessels in areas.
+
+        With adaptive_time_period timespan of request is time since start of last successful poll plus
+        time_period_margin minutes (but not less than min_time_period and not more than requested time_period),
+        so overlapping polls do not fetch the same positions again.
+
+        In emulation mode (get_vessels with emulation=True) traffic of emulation_vessels distinct vessels is simulated
+        by MT_traffic_simulator within bounds of monitoring areas. With emulation_seed simulation is reproducible.
+
+        Durations of stages (fetch, parse, filter, new_detection, export_file, export_web), numbers of vessels,
+        HTTP requests, retries and errors and schedule lag are collected to self.metrics (MT_metrics).
+        Snapshot is returned by self.metrics.snapshot(). With metrics_port they are also served on
+        http://127.0.0.1:<metrics_port>/metrics in Prometheus format (see start_metrics_server).
+
+        All HTTP requests go through transport (MT_transport) with pooled keep-alive sessions, timeouts and retries.
+        By default every monitor creates its own transport, pass configured MT_transport to change timeouts,
+        retries or pool size, or to share connections between monitors.
 
         :param mode: Mode for interacting with MarineTraffic
         :type mode: str
@@ -64,47 +129,192 @@ class MTMonitor():
 
         :param MT_API_Key: API Key for MarineTraffic.com API Service
         :type MT_API_Key: str
+
+        :param vectorized_filtering: Filter vessels by areas in batch mode
+        :type vectorized_filtering: bool
+
+        :param vessel_registry_ttl: Time in minutes to remember vessels (60 by default)
+        :type vessel_registry_ttl: int
+
+        :param vessel_registry_file: Path to JSON file for vessel registry snapshots
+        :type vessel_registry_file: str
+
+        :param max_concurrent_requests: Limit of simultaneous PS06 requests (4 by default)
+        :type max_concurrent_requests: int
+
+        :param min_request_interval: Minimal time in seconds between starts of API requests (0 by default)
+        :type min_request_interval: float
+
+        :param transport: HTTP transport for MarineTraffic and NGW requests
+        :type transport: MT_transport
+
+        :param stream_responses: Parse MarineTraffic responses incrementally
+        :type stream_responses: bool
+
+        :param response_protocol: Protocol of MarineTraffic responses: 'jsono' or 'csv'
+        :type response_protocol: str
+
+        :param deduplicate_positions: Drop positions already returned by previous polls
+        :type deduplicate_positions: bool
+
+        :param adaptive_time_period: Request only time passed since last successful poll
+        :type adaptive_time_period: bool
+
+        :param emulation_vessels: Number of simulated vessels in emulation mode (10 by default)
+        :type emulation_vessels: int
+
+        :param emulation_seed: Seed of traffic simulation
+        :type emulation_seed: int
+
+        :param metrics: Metrics registry, new one by default (pass the same registry to several monitors to sum them up)
+        :type metrics: MT_metrics
+
+        :param metrics_port: Port of local /metrics endpoint, not started by default
+        :type metrics_port: int
+
+        :param area_simplify_tolerance: Tolerance of monitoring areas simplification in degrees, no simplification by default
+        :type area_simplify_tolerance: float
+
+        :param area_cache_dir: Directory for cache of reprojected monitoring areas, no cache by default
+        :type area_cache_dir: str
+
+        :param reload_areas: Reload monitoring areas before poll if monitoring_area_source file was changed
+        :type reload_areas: bool
+
+        :param request_coalescer: Deduplication of identical MarineTraffic requests shared with other monitors.
+        Responses are fully read before they are filtered, if it is set
+        :type request_coalescer: MT_request_coalescer
+
+        :param log_file: Path to log file. Log is written as JSON lines and rotated by size and time
+        :type log_file: str
+
+        :param log_level: 'DEBUG', 'INFO', 'WARNING' or 'ERROR'. Full vessel lists are logged only with 'DEBUG'
+        :type log_level: str
         """
 
+        if log_file:
+            self.log_file = log_file
+        if log_level:
+            self.log_level = log_level
+        self.logger = MT_logger(self.log_file, level=self.log_level)
+
         self.MT_API_Key = MT_API_Key
+        self.vectorized_filtering = vectorized_filtering
+        self.stream_responses = stream_responses
+        if response_protocol not in ['jsono', 'csv']:
+            self.log_message('Invalid response protocol. Valid options are: jsono, csv. Auto set to jsono', level='warning')
+            self.response_protocol = 'jsono'
+        else:
+            self.response_protocol = response_protocol
+        self.deduplicate_positions = deduplicate_positions
+        self.adaptive_time_period = adaptive_time_period
+        self.last_successful_poll_time = None
+        if emulation_vessels:
+            self.emulation_vessels = emulation_vessels
+        self.emulation_seed = emulation_seed
+        self.traffic_simulator = None
+        self.vessel_registry = MT_vessel_registry(ttl=vessel_registry_ttl, snapshot_file=vessel_registry_file)
+        self.transport = transport or MT_transport()
+        self.request_coalescer = request_coalescer
+        self.metrics = metrics or MT_metrics()
+        if self.transport.metrics is None:
+            self.transport.metrics = self.metrics
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.start_metrics_server(metrics_port)
+
+        if max_concurrent_requests:
+            self.max_concurrent_requests = max_concurrent_requests
+        if min_request_interval is not None:
+            self.min_request_interval = min_request_interval
+        self.monitoring_areas = []
+        self.area_index = None
+        self.monitoring_areas_with_index = ([], None)
+        self.last_area_errors = {}
+        self.NGW_sync_state = {}
+        self.last_request_time = 0
+        self.__request_lock = threading.Lock()
 
         if mode not in ['Predefined','Custom']:
-            self.log_message('Invalid mode. Valid options are: Predefined, Custom. Auto set to Predefined')
+            self.log_message('Invalid mode. Valid options are: Predefined, Custom. Auto set to Predefined', level='warning')
             self.mode = 'Predefined'
         else:
             self.mode = mode
 
-        if log_file:
-            self.log_file = log_file
-
+        self.reload_areas = reload_areas
+        self.area_loader = None
         if monitoring_area_source:
-            source_dataset = fiona.open(monitoring_area_source)
+            from MT_area_loader import MT_area_loader
+            self.area_loader = MT_area_loader(monitoring_area_source, simplify_tolerance=area_simplify_tolerance,
+                                              cache_dir=area_cache_dir)
+            self.set_monitoring_areas(self.area_loader.load())
+            self.log_message('Monitoring areas loaded', areas=len(self.monitoring_areas),
+                             skipped_features=self.area_loader.skipped_features, from_cache=self.area_loader.loaded_from_cache)
+
+    def set_monitoring_areas(self, monitoring_areas, area_index=None):
+        """
+        Replace monitoring areas of this monitor
 
-            source_epsg = source_dataset.crs['init']
+        :param monitoring_areas: Areas as dicts with 'geometry' (shapely geometry or GeoJSON-like dict in EPSG:4326),
+        'bounds' (dict with x_min, x_max, y_min, y_max) and optional 'id'
+        :type monitoring_areas: list
 
-            if str(source_epsg).lower() != 'epsg:4326':
-                monitoring_area_full_shapes = self.__get_reprojected_vector_dataset_coordinates(source_dataset, source_epsg, 'epsg:4326')
-            else:
-                monitoring_area_full_shapes = self.__get_raw_vector_dataset_coordinates(source_dataset)
+        :param area_index: Index already built over the same areas (i.e. shared by several monitors), built by default
+        :type area_index: MT_area_index
+
+        Areas and index are published together as tuple monitoring_areas_with_index by one assignment, readers
+        in other threads (i.e. sink workers) must take both from it to never get list and index of different areas.
+        """
+        # Polygons are built and prepared once here, not for every vessel in get_vessels
+        if area_index is None:
+            from MT_area_index import MT_area_index
+            area_index = MT_area_index([area['geometry'] for area in monitoring_areas])
+        self.monitoring_areas_with_index = (monitoring_areas, area_index)
+        self.area_index = area_index
+        self.monitoring_areas = monitoring_areas
+
+    def log_message(self, message, level='info', **fields):
+        """
+        Write message to log. Writing is done in background, so this call does not block.
+
+        :param message: Text of message
+        :type message: str
+
+        :param level: 'debug', 'info', 'warning' or 'error'
+        :type level: str
 
-            for feature in monitoring_area_full_shapes:
-                self.monitoring_areas.append({'geometry':feature,'bounds':self.__get_bounds_from_coordinates(feature)})
+        :param fields: Additional fields of JSON log line
+        """
+        self.logger.log(level, message, **fields)
+
+    def start_metrics_server(self, port=9108, host='127.0.0.1'):
+        """
+        Start local HTTP server with metrics in Prometheus text format on /metrics (and JSON snapshot on /metrics.json)
 
+        :param port: Port to listen, 0 for any free port
+        :type port: int
 
-    def log_message(self, message):
-        if not os.path.exists(self.log_file):
-            with open(self.log_file, 'w') as fl:
-                pass
+        :param host: Interface to listen, only local by default
+        :type host: str
 
-        with open(self.log_file,'a') as fl:
-            fl.write('%s | %s \n' % (datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), message))
+        :return: MT_metrics_server, its port is in .port
+        """
+        if self.metrics_server is None:
+            self.metrics_server = MT_metrics_server(self.metrics, port=port, host=host)
+            self.log_message('Metrics server started', port=self.metrics_server.port)
+        return self.metrics_server
+
+    def log_payload(self, message, payload):
+        # Full payloads (i.e. vessel lists) are huge, so they are serialized only when debug level is on
+        if self.logger.is_debug():
+            self.log_message(message, level='debug', payload=payload)
 
     def get_vessels(self, time_period=None, emulation=False):
         """
         Interaction with MarineTraffic API
 
         Performing request with defined during initialization Mode and API Key.
-        If emulation is True, random vessels generated
+        If emulation is True, vessels are taken from traffic simulator (see MT_traffic_simulator)
 
         :param emulation: Generate vessels without interacting with API (for tests)
         :type emulation: bool
@@ -112,85 +322,86 @@ class MTMonitor():
         :param time_period: Time to observe vessels in minutes
         :type time_period: int
 
-        :return: filtered list of vessels as list of dicts
+        :return: filtered list of vessels as list of MT_vessel records (they could be used as dicts too)
         """
 
         request_time = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        poll_start_time = time.time()
+        self.metrics.increment('polls')
+        if self.reload_areas and self.area_loader is not None:
+            self.__reload_monitoring_areas()
         vessels_filtered = []
         if not time_period:
             time_period = self.default_time_period
+        if self.adaptive_time_period:
+            time_period = self.__get_adaptive_time_period(time_period, poll_start_time)
 
         ##### EMULATION FOR TESTS
+        # Simulated traffic goes through the same filtering as API responses
 
         if emulation:
-            vessels = []
-            for i in range(0,10,1):
-                x = random.uniform (58.3209,59.6744)
-                y = random.uniform(68.9573, 69.544)
-                vessel = {"MMSI":"304010417","IMO":"9015462","SHIP_ID":"359396","LAT":str(y),"LON":str(x),"SPEED":"74","HEADING":"329","COURSE":"327","STATUS":"0","TIMESTAMP":"2017-05-19T09:39:57","DSRC":"TER","UTC_SECONDS":"54"}
-                vessels.append(vessel)
-
-            if self.monitoring_areas:
-                for area in self.monitoring_areas:
-                    #print 'Vessels:'
-                    #print vessels
-                    for vessel in vessels:
-                        if self.__point_inside_polygon(float(vessel['LON']), float(vessel['LAT']), area['geometry']):
-                            vessels_filtered.append(vessel)
-            else:
-                vessels_filtered = vessels
+            self.__get_traffic_simulator().advance()
 
         ##### END EMULATION
 
-        else:
-
-            if self.mode == 'Predefined':
+        if self.mode == 'Predefined':
+            if emulation:
+                vessels = self.traffic_simulator.get_payload(time_period)
+            else:
                 vessels = self.__marine_traffic_vp_in_predifined_area_request(time_period)
-                self.log_message(vessels)
-                if self.monitoring_areas:
-                    for area in self.monitoring_areas:
-                        #print 'Vessels:'
-                        #print vessels
-                        for vessel in vessels:
-                            if self.__point_inside_polygon(float(vessel['LON']), float(vessel['LAT']), area['geometry']):
-                                vessels_filtered.append(vessel)
-                else:
-                    vessels_filtered = vessels
-
-            elif self.mode == 'Custom':
-                if not self.monitoring_areas:
-                    self.log_message('Monitoring area must be specified. Provide it with option monitoring_area_source while' \
-                          'class object initialization')
-                    return vessels_filtered
-                else:
-                    for area in self.monitoring_areas:
-                        vessels = self.__marine_traffic_vp_in_custom_area_request(time_period,
-                                                                           area['bounds']['y_min'],
-                                                                           area['bounds']['y_max'],
-                                                                           area['bounds']['x_min'],
-                                                                           area['bounds']['x_max'])
-                        for vessel in vessels:
-                            if self.__point_inside_polygon(float(vessel['LON']), float(vessel['LAT']), area['geometry']):
-                                vessels_filtered.append(vessel)
-
-
+            vessels_filtered = self.__filter_vessels_by_areas(vessels)
 
+        elif self.mode == 'Custom':
+            if not self.monitoring_areas:
+                self.log_message('Monitoring area must be specified. Provide it with option monitoring_area_source while' \
+                      'class object initialization', level='error')
+                return vessels_filtered
+            else:
+                # Bounding boxes of areas may overlap, so the same position can come in several responses.
+                # Vessels are identified as in registry, tracks and history (SHIP_ID, MMSI if SHIP_ID is absent),
+                # vessels without both are never merged
+                seen_positions = set()
+                for area_number, vessels in self.__request_custom_areas(time_period, emulation):
+                    for vessel in vessels:
+                        position_key = (vessel.key, vessel.timestamp)
+                        if not vessel.key:
+                            vessels_filtered.append(vessel)
+                        elif position_key not in seen_positions:
+                            seen_positions.add(position_key)
+                            vessels_filtered.append(vessel)
 
         # Writing attributes NEW for new vessels and REQUEST_TIME
-        self.log_message(vessels_filtered)
+        self.log_message('Filtered vessels', vessels=len(vessels_filtered))
+        self.log_payload('Filtered vessels', vessels_filtered)
+        seen_time = time.time()
+        self.vessel_registry.evict(seen_time)
+        vessels_deduplicated = []
         for vessel_new_response in vessels_filtered:
+            is_known_position = self.vessel_registry.is_known_position(vessel_new_response)
             vessel_new_response['REQUEST_TIME'] = request_time
-            vessel_new_response['NEW'] = True
-            for vessel_last_response in self.last_vessels_response:
-                if vessel_new_response['SHIP_ID'] == vessel_last_response['SHIP_ID']:
-                    vessel_new_response['NEW'] = False
-
+            vessel_new_response['NEW'] = self.vessel_registry.register(vessel_new_response, seen_time)
+            if not (self.deduplicate_positions and is_known_position):
+                vessels_deduplicated.append(vessel_new_response)
+        self.vessel_registry.save_if_due()
+        self.metrics.observe('stage_seconds', time.time() - seen_time, stage='new_detection')
+
+        if self.deduplicate_positions:
+            self.log_message('Positions received in previous polls dropped',
+                             vessels=len(vessels_filtered) - len(vessels_deduplicated))
+            vessels_filtered = vessels_deduplicated
+
+        # Areas failed in Custom mode are requested with longer timespan next time
+        if emulation or self.mode == 'Predefined' or not self.last_area_errors:
+            self.last_successful_poll_time = poll_start_time
+
+        self.metrics.observe('stage_seconds', time.time() - poll_start_time, stage='poll')
+        self.metrics.set_gauge('last_poll_vessels', len(vessels_filtered))
         self.last_vessels_response = vessels_filtered
         return vessels_filtered
 
-    def export_vessels_to_file (self, output_file, output_type='GeoJSON', write_mode='new'):
+    def export_vessels_to_file (self, output_file, output_type='GeoJSON', write_mode='new', output_crs='epsg:4326', vessels=None):
         """
-        Exporting result of last get_vessels call to vector file
+        Exporting result of last get_vessels call (or given vessels) to vector file
 
         output_type could be any type supported by Fiona lib:
         'ESRI Shapefile', 'MapInfo File', 'GeoJSON', 'PDS', 'FileGDB',
@@ -202,6 +413,13 @@ class MTMonitor():
         (for manual call 1 and 2 are equal)
         3. append - append new vessels to existing file
 
+        In append mode time of writing depends on number of new vessels, not on size of file, for GeoJSON and
+        drivers with own append support (i.e. GPKG, Shapefile). GeoJSON features are added before closing brackets
+        of FeatureCollection, existing features are not read (GDAL would parse and rewrite whole file).
+        Other drivers write all vessels in one transaction if they support them (i.e. GPKG). For drivers that
+        can't append (i.e. GPX, DXF, GML) existing features are streamed with new vessels to temporary file,
+        which then replaces output file, so time grows with file.
+
         :param output_file: Path to output file
         :type output_file: str
 
@@ -210,8 +428,21 @@ class MTMonitor():
 
         :param write_mode: Exporting mode
         :type write_mode: str
+
+        :param output_crs: CRS of output file as 'epsg:XXXX' (epsg:4326 by default)
+        :type output_crs: str
+
+        :param vessels: Vessels to export instead of last_vessels_response
+        :type vessels: list
         """
 
+        with self.metrics.timer('stage_seconds', stage='export_file'):
+            self.__export_vessels_to_file(output_file, output_type, write_mode, output_crs, vessels)
+
+    def __export_vessels_to_file(self, output_file, output_type, write_mode, output_crs, vessels):
+        # last_vessels_response could be set outside as list of dicts
+        vessels = MT_vessel.from_records(self.last_vessels_response if vessels is None else vessels)
+
         output_schema = {'geometry': 'Point',
                          'properties': {'LAT': 'str',
                                         'LON': 'str',
@@ -228,53 +459,30 @@ class MTMonitor():
                                         'NEW': 'str',
                                         'REQUEST_TIME': 'str'}}
 
+        import fiona
         if (not os.path.exists(output_file)) or (write_mode == 'new') or (write_mode == 'rewrite'):
             if os.path.exists(output_file):
                 os.remove(output_file)
 
-            output = fiona.open(output_file, 'w', driver=output_type, schema=output_schema, crs=from_epsg(4326))
+            with fiona.open(output_file, 'w', driver=output_type, schema=output_schema, crs=self.__get_fiona_crs(output_crs)) as output:
+                output.writerecords(self.__describe_vessels_for_file(vessels, output_crs))
 
         elif write_mode == 'append':
-            input = fiona.open(output_file,'r')
-            input_schema = input.schema.copy()
-            input_driver = input.driver
-            features = list(input.items())
-            input.close()
-            os.remove(output_file)
-            output = fiona.open(output_file, 'w', driver=input_driver, schema=input_schema, crs=from_epsg(4326))
-            for feature in features:
-                output.write(feature[1])
+            if output_type == 'GeoJSON' and self.__append_vessels_to_geojson(vessels, output_file, output_crs):
+                return
+            if 'a' in fiona.supported_drivers.get(output_type, ''):
+                with fiona.open(output_file, 'a', driver=output_type) as output:
+                    output.writerecords(self.__adapt_records_to_fields(self.__describe_vessels_for_file(vessels, output_crs),
+                                                                       list(output.schema['properties'].keys())))
+            else:
+                self.__append_vessels_with_file_copy(vessels, output_file, output_type, output_schema, output_crs)
         else:
-            self.log_message('unsupported mode')
+            self.log_message('unsupported mode', level='error')
             return
 
-        for vessel in self.last_vessels_response:
-            # print vessel
-            coordinate = Point(float(vessel['LON']), float(vessel['LAT']))
-            # print float(vessel['LON'])
-            #print mapping(coordinate)
-            properties = {'LAT': vessel['LAT'],
-                          'LON': vessel['LON'],
-                          'SHIP_ID': vessel['SHIP_ID'],
-                          'MMSI': vessel['MMSI'],
-                          'IMO': vessel['IMO'],
-                          'SPEED': vessel['SPEED'],
-                          'HEADING': vessel['HEADING'],
-                          'COURSE': vessel['COURSE'],
-                          'STATUS': vessel['STATUS'],
-                          'TIMESTAMP': vessel['TIMESTAMP'],
-                          'DSRC': vessel['DSRC'],
-                          'UTC_SECONDS': vessel['UTC_SECONDS'],
-                          'NEW': str(vessel['NEW']),
-                          'REQUEST_TIME': str(vessel['REQUEST_TIME'])}
-
-            output.write({'geometry': mapping(coordinate), 'properties': properties})
-
-        output.close()
-
-    def export_vessels_to_web(self, nextgis_web_api_options, write_mode='rewrite'):
+    def export_vessels_to_web(self, nextgis_web_api_options, write_mode='rewrite', chunk_size=None, parallel_chunks=None, vessels=None):
         """
-        Export vessels NextGIS Web
+        Export vessels of last get_vessels call (or given vessels) to NextGIS Web
 
         nextgis_web_api_options - dictionary, containing all information about NGW connection. Keys are:
         1. 'user' - NGW username (i.e. administrator)
@@ -284,27 +492,176 @@ class MTMonitor():
         ! resource must have certain structure. You can initializate it with sample Shapefile or with
         self.init_NGW_resource_for_vessels function
 
-        mode defines behaviour of exporter. Two ways are supported:
+        mode defines behaviour of exporter. Three ways are supported:
         1. rewrite - all existing in resource features will be deleted, then write new vessels
         2. append - append new vessels to existing features
+        3. sync - resource is kept equal to last response, but only changes are sent: new vessels are added,
+        moved vessels are updated, vessels that left monitoring areas are deleted. Correspondence of SHIP_ID and
+        NGW feature id is kept by monitor and is read from resource on first call. Resources created before
+        SHIP_ID field was added to vessel layer are matched by MMSI.
+
+        Vessels are sent in chunks of chunk_size features (500 by default) with bulk feature requests,
+        parallel_chunks chunks at once (2 by default). Failed chunks are logged and returned,
+        other chunks are written anyway.
 
-        :param write_mode: 'rewrite' or 'append'.
+        :param write_mode: 'rewrite', 'append' or 'sync'.
         :param nextgis_web_api_options: All necessary API options as dict: {'url':'', 'username':'', 'password':'', 'resource_id': 0}
+
+        :param chunk_size: Number of vessels in one request
+        :type chunk_size: int
+
+        :param parallel_chunks: Number of requests performed at once
+        :type parallel_chunks: int
+
+        :param vessels: Vessels to export instead of last_vessels_response
+        :type vessels: list
+
+        :return: list of failed chunks as dicts {'chunk', 'start', 'size', 'error'}
         """
-        self.log_message('Last vessels: %s' % str(self.last_vessels_response))
-        if write_mode == 'rewrite':
-            self.__delete_all_features_from_NGW_resource(nextgis_web_api_options)
-            for vessel in self.last_vessels_response:
-                vessel_ngw = self.__describe_vessel_for_NGW(vessel)
-                self.__add_feature_to_NGW_resource(vessel_ngw, nextgis_web_api_options)
+        export_start_time = time.time()
+        # last_vessels_response could be set outside as list of dicts
+        vessels = MT_vessel.from_records(self.last_vessels_response if vessels is None else vessels)
+        self.log_payload('Last vessels', vessels)
+        from MT_NGW_writer import MT_NGW_writer
+        writer = MT_NGW_writer(nextgis_web_api_options, self.transport, chunk_size=chunk_size, parallel_chunks=parallel_chunks)
+
+        if write_mode == 'sync':
+            failed_chunks = self.__sync_vessels_to_NGW_resource(vessels, nextgis_web_api_options, writer)
+        elif write_mode in ['rewrite', 'append']:
+            if write_mode == 'rewrite':
+                self.__delete_all_features_from_NGW_resource(nextgis_web_api_options)
+            features = self.__describe_vessels_for_NGW(vessels)
+            ids, failed_chunks = writer.write_features(features)
+        else:
+            self.log_message('Unsupported mode', level='error')
+            return []
+
+        for failed_chunk in failed_chunks:
+            self.log_message('Failed to write %s vessels starting from %s to NGW! Text: %s' %
+                             (failed_chunk['size'], failed_chunk['start'], failed_chunk['error']), level='error')
+        self.metrics.increment('ngw_failed_chunks', len(failed_chunks))
+        self.metrics.observe('stage_seconds', time.time() - export_start_time, stage='export_web')
+        self.last_NGW_errors = failed_chunks
+        return failed_chunks
+
+    def export_tracks_to_file(self, track_builder, output_file, output_type='GeoJSON', output_crs='epsg:4326'):
+        """
+        Exporting vessel tracks as LineString features to vector file (file is rewritten)
 
-        elif write_mode == 'append':
-            for vessel in self.last_vessels_response:
-                vessel_ngw = self.__describe_vessel_for_NGW(vessel)
-                self.__add_feature_to_NGW_resource(vessel_ngw, nextgis_web_api_options)
+        Tracks with less than two positions are not exported. If simplify_tolerance of track builder
+        is set, tracks are simplified.
+
+        :param track_builder: Builder with tracks of vessels
+        :type track_builder: MT_track_builder
+
+        :param output_file: Path to output file
+        :type output_file: str
+
+        :param output_type: Type of output file
+        :type output_type: str
 
+        :param output_crs: CRS of output file as 'epsg:XXXX' (epsg:4326 by default)
+        :type output_crs: str
+        """
+        output_schema = {'geometry': 'LineString',
+                         'properties': {'SHIP_ID': 'str',
+                                        'MMSI': 'str',
+                                        'START_TIME': 'str',
+                                        'END_TIME': 'str',
+                                        'POINTS': 'str'}}
 
-    def automated_vessels_to_file (self, output_file, write_mode = 'new', output_type='GeoJSON', run_period=None, time_period=None, emulation=False):
+        import fiona
+        tracks = [track for track in track_builder.tracks.values() if len(track) > 1]
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        with fiona.open(output_file, 'w', driver=output_type, schema=output_schema, crs=self.__get_fiona_crs(output_crs)) as output:
+            output.writerecords({'geometry': {'type': 'LineString',
+                                              'coordinates': MT_transform.transform_coordinates(
+                                                  track.get_coordinates(track_builder.simplify_tolerance),
+                                                  'epsg:4326', output_crs)},
+                                 'properties': track_builder.describe_track(track)}
+                                for track in tracks)
+
+    def export_tracks_to_web(self, track_builder, nextgis_web_api_options, write_mode='sync', chunk_size=None, parallel_chunks=None):
+        """
+        Export vessel tracks as LineString features to NextGIS Web
+
+        Resource must have LINESTRING geometry and fields SHIP_ID, MMSI, START_TIME, END_TIME, POINTS.
+        You can initializate it with self.init_NGW_resource_for_tracks function
+
+        mode defines behaviour of exporter:
+        1. rewrite - all existing in resource features will be deleted, then all tracks are written
+        2. sync - only tracks changed since previous export are sent: new tracks are added, extended ones are updated,
+        tracks dropped by builder are deleted. Sync export should be the only consumer of builder changes.
+
+        :param track_builder: Builder with tracks of vessels
+        :type track_builder: MT_track_builder
+
+        :param nextgis_web_api_options: All necessary API options as dict: {'url':'', 'username':'', 'password':'', 'resource_id': 0}
+
+        :param write_mode: 'rewrite' or 'sync'
+        :type write_mode: str
+
+        :param chunk_size: Number of tracks in one request
+        :type chunk_size: int
+
+        :param parallel_chunks: Number of requests performed at once
+        :type parallel_chunks: int
+
+        :return: list of failed chunks as dicts {'chunk', 'start', 'size', 'error'}
+        """
+        state_key = (nextgis_web_api_options['url'], nextgis_web_api_options['resource_id'])
+        from MT_NGW_writer import MT_NGW_writer
+        writer = MT_NGW_writer(nextgis_web_api_options, self.transport, chunk_size=chunk_size, parallel_chunks=parallel_chunks)
+
+        changed, removed = track_builder.pop_changes()
+        if write_mode == 'rewrite':
+            self.__delete_all_features_from_NGW_resource(nextgis_web_api_options)
+            tracks = [track for track in track_builder.tracks.values() if len(track) > 1]
+            for track in tracks:
+                track.ngw_ids.pop(state_key, None)
+            removed = []
+        elif write_mode == 'sync':
+            tracks = [track for track in changed if len(track) > 1]
+        else:
+            self.log_message('Unsupported mode', level='error')
+            return []
+
+        features = []
+        for track in tracks:
+            feature = {'extensions': {'attachment': None, 'description': None},
+                       'fields': track_builder.describe_track(track),
+                       'geom': 'LINESTRING (%s)' % ', '.join('%s %s' % coordinate for coordinate in
+                                                             MT_transform.transform_coordinates(
+                                                                 track.get_coordinates(track_builder.simplify_tolerance),
+                                                                 'epsg:4326', 'epsg:3857'))}
+            if state_key in track.ngw_ids:
+                feature['id'] = track.ngw_ids[state_key]
+            features.append(feature)
+
+        ids, failed_chunks = writer.write_features(features)
+        for track, feature_id in zip(tracks, ids):
+            if feature_id is not None:
+                track.ngw_ids[state_key] = feature_id
+            else:
+                # Track is sent again on next export
+                track_builder.changed.add(track.key)
+
+        removed = [track for track in removed if state_key in track.ngw_ids]
+        deleted_ids, failed_delete_chunks = writer.delete_features([track.ngw_ids[state_key] for track in removed])
+        for track, deleted_id in zip(removed, deleted_ids):
+            if deleted_id is None:
+                track_builder.removed[track.key] = track
+        failed_chunks.extend(failed_delete_chunks)
+
+        for failed_chunk in failed_chunks:
+            self.log_message('Failed to write %s tracks starting from %s to NGW! Text: %s' %
+                             (failed_chunk['size'], failed_chunk['start'], failed_chunk['error']), level='error')
+        self.last_NGW_errors = failed_chunks
+        return failed_chunks
+
+    def automated_vessels_to_file (self, output_file, write_mode = 'new', output_type='GeoJSON', run_period=None, time_period=None, emulation=False,
+                                   output_crs='epsg:4326'):
         """
         Launching periodical requesting vessels and writing them to file
 
@@ -314,10 +671,12 @@ class MTMonitor():
 
         run_period - time in minutes before function launches (i.e. 2)
 
-        Three write_modes supported:
+        Four write_modes supported:
         1. new - will create new file with unique name everytime. To basename of output_file added timestamp
         2. rewrite - each time rewriting one file (output_file)
         3. append - append new vessels to existing features of output_file
+        4. rotate - append vessels to hourly GeoJSONSeq segments in directory of output_file, named by its basename
+        and compressed with gzip when closed, output_type is ignored (see MT_rotating_file_sink)
 
         :param emulation: Emulate vessels instead of API requests
         :type emulation bool
@@ -336,34 +695,22 @@ class MTMonitor():
 
         :param output_type: Output file(s) type
         :type output_type: str
-        """
-
-        start_time = time.time()
-        while True:
-            self.log_message('Performing request...')
-            self.get_vessels(time_period=time_period, emulation=emulation)
-
-            if write_mode == 'new':
-                now = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
-
-                new_name = os.path.join(os.path.dirname(output_file),
-                                        '%s_%s.%s' % (os.path.basename(output_file).split('.')[0],
-                                                      now,
-                                                      os.path.basename(output_file).split('.')[1]))
-
-                self.export_vessels_to_file(new_name, output_type=output_type, write_mode=write_mode)
-
-            elif write_mode == 'append':
-                self.export_vessels_to_file(output_file, output_type=output_type, write_mode=write_mode)
-            elif write_mode == 'rewrite':
-                self.export_vessels_to_file(output_file, output_type=output_type, write_mode=write_mode)
-            else:
-                self.log_message('Unsupported mode')
-                break
 
-            time.sleep(run_period * 60.0 - ((time.time() - start_time) % (run_period * 60.0)))
+        :param output_crs: CRS of output file(s) as 'epsg:XXXX'
+        :type output_crs: str
+        """
 
+        if write_mode not in ['new', 'rewrite', 'append', 'rotate']:
+            self.log_message('Unsupported mode', level='error')
+            return
 
+        from MT_sinks import MT_file_sink, MT_rotating_file_sink
+        if write_mode == 'rotate':
+            sink = MT_rotating_file_sink(os.path.dirname(output_file) or '.',
+                                         prefix=os.path.splitext(os.path.basename(output_file))[0])
+        else:
+            sink = MT_file_sink(self, output_file, write_mode=write_mode, output_type=output_type, output_crs=output_crs)
+        self.automated_vessels_to_sinks([sink], run_period=run_period, time_period=time_period, emulation=emulation)
 
     def automated_vessels_to_web(self, nextgis_web_api_options, run_period=None, time_period=None, write_mode='rewrite', emulation=False):
         """
@@ -379,9 +726,10 @@ class MTMonitor():
 
         run_period - time in minutes before function launches (i.e. 2)
 
-        Two write_modes supported:
+        Three write_modes supported:
         1. rewrite - each time rewriting all features in resource
         2. append - each time appending new vessels to resource
+        3. sync - each time sending only changes: new, moved and gone vessels
 
         :param write_mode: Mode of writing new data
         :type write_mode: str
@@ -399,18 +747,56 @@ class MTMonitor():
         :type time_period: int
         """
 
-        start_time = time.time()
-        while True:
-            self.log_message('Performing request...')
-            try:
-                self.get_vessels(time_period=time_period, emulation=emulation)
+        if write_mode not in ['rewrite', 'append', 'sync']:
+            self.log_message('Unsupported mode', level='error')
+            return
 
-                self.export_vessels_to_web(nextgis_web_api_options, write_mode)
+        from MT_sinks import MT_NGW_sink
+        sink = MT_NGW_sink(self, nextgis_web_api_options, write_mode=write_mode)
+        self.automated_vessels_to_sinks([sink], run_period=run_period, time_period=time_period, emulation=emulation)
 
-                time.sleep(run_period * 60.0 - ((time.time() - start_time) % (run_period * 60.0)))
-            except Exception as e:
-                self.log_message('Exception while performing request! Text: %s' % str(e))
-                time.sleep(run_period * 60.0 - ((time.time() - start_time) % (run_period * 60.0)))
+    def automated_vessels_to_sinks(self, sinks, run_period=None, time_period=None, emulation=False, queue_size=1,
+                                   overrun_policy='coalesce', cycles=None, polling_policy=None):
+        """
+        Launching periodical requesting vessels and writing them to several destinations at once
+
+        Request and writing are pipelined: every sink is written in its own thread, so next request
+        is performed on time even if some sink is slow. If sink is still busy with previous snapshots
+        when queue_size of them are waiting, new one is skipped (overrun_policy='skip') or merged with
+        the waiting one (overrun_policy='coalesce'). Lag and errors of every sink are logged and could be
+        read from self.scheduler.get_stats()
+
+        Sinks are MT_file_sink, MT_NGW_sink (see MT_sinks.py) or any subclass of MT_sink
+
+        :param sinks: Destinations of vessels
+        :type sinks: list of MT_sink
+
+        :param run_period: How often to run method
+        :type run_period: int
+
+        :param time_period: Time to observe vessels in minutes
+        :type time_period: int
+
+        :param emulation: Emulate vessels instead of API requests
+        :type emulation bool
+
+        :param queue_size: Number of snapshots waiting for every sink
+        :type queue_size: int
+
+        :param overrun_policy: 'coalesce' or 'skip'
+        :type overrun_policy: str
+
+        :param cycles: Number of requests to perform, infinite by default
+        :type cycles: int
+
+        :param polling_policy: Policy of period between requests (see MT_polling_policy.py), constant run_period by default
+        :type polling_policy: MT_polling_policy
+        """
+
+        from MT_scheduler import MT_scheduler
+        self.scheduler = MT_scheduler(self, sinks, run_period=run_period, time_period=time_period, emulation=emulation,
+                                      queue_size=queue_size, overrun_policy=overrun_policy, polling_policy=polling_policy)
+        self.scheduler.run(cycles=cycles)
 
     def init_NGW_resource_for_vessels(self, nextgis_web_api_options, display_name, keyname):
         """
@@ -436,118 +822,414 @@ class MTMonitor():
         :type keyname: str
         :return: answer of NGW API
         """
+        from MT_NGW_init_schemes import MT_NGW_init_schemes
         scheme_init = MT_NGW_init_schemes(nextgis_web_api_options['resource_id'], display_name, keyname)
-        resource = scheme_init.get_init_vector_layer()
+        return self.__init_NGW_resource(nextgis_web_api_options, scheme_init, scheme_init.get_init_vector_layer())
+
+    def init_NGW_resource_for_tracks(self, nextgis_web_api_options, display_name, keyname):
+        """
+        Initialization of new resource in NGW with scheme for vessel tracks storing (see export_tracks_to_web)
+
+        Options are the same as for init_NGW_resource_for_vessels, 'resource_id' is id of PARENT resource
+
+        :param nextgis_web_api_options: All necessary API options
+        :type nextgis_web_api_options: dict
+
+        :param display_name: display name for new vector layer
+        :type display_name: str
+
+        :param keyname: keyname for new vector layer
+        :type keyname: str
+        :return: answer of NGW API
+        """
+        from MT_NGW_init_schemes import MT_NGW_init_schemes
+        scheme_init = MT_NGW_init_schemes(nextgis_web_api_options['resource_id'], display_name, keyname)
+        return self.__init_NGW_resource(nextgis_web_api_options, scheme_init, scheme_init.get_init_track_layer())
+
+
+    #### Service private methods
+
+    def __init_NGW_resource(self, nextgis_web_api_options, scheme_init, resource):
         url = urljoin(nextgis_web_api_options['url'], 'api/resource/')
-        r = requests.post(url, data=resource,
-                          auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
+        r = self.transport.post(url, data=resource,
+                                auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
         # print r.text
         r_loaded = json.loads(r.text)
-        self.log_message(r_loaded)
+        self.log_message('NGW resource created', response=r_loaded)
         new_resource_id = r_loaded['id']
 
         style = scheme_init.get_init_mapserver_style(new_resource_id)
-        r = requests.post(url, data=style,
-                          auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
+        r = self.transport.post(url, data=style,
+                                auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
         # print r.text
         r_loaded = json.loads(r.text)
 
         return r_loaded
 
+    def __request_custom_areas(self, timespan, emulation=False):
+        # Areas are requested by bounded pool of threads. Failed area is logged and skipped,
+        # responses of other areas are kept. Errors of last poll are available in self.last_area_errors.
+        # All areas of poll are taken with their index at once, so they are not changed in the middle of poll
+        areas_with_index = self.monitoring_areas_with_index
+        monitoring_areas = areas_with_index[0]
 
-    #### Service private methods
+        def request_area(area_number):
+            area = monitoring_areas[area_number]
+            try:
+                if emulation:
+                    vessels = self.traffic_simulator.get_payload(timespan, area['bounds'])
+                else:
+                    self.__wait_request_slot()
+                    vessels = self.__marine_traffic_vp_in_custom_area_request(timespan,
+                                                                              area['bounds']['y_min'],
+                                                                              area['bounds']['y_max'],
+                                                                              area['bounds']['x_min'],
+                                                                              area['bounds']['x_max'])
+                return area_number, self.__filter_vessels_by_areas(vessels, area_number, areas_with_index), None
+            except Exception as e:
+                return area_number, [], e
+
+        from multiprocessing.pool import ThreadPool
+        areas_count = len(monitoring_areas)
+        pool = ThreadPool(max(1, min(self.max_concurrent_requests, areas_count)))
+        try:
+            results = pool.map(request_area, range(areas_count))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.last_area_errors = {}
+        area_responses = []
+        for area_number, vessels, error in results:
+            if error is not None:
+                self.metrics.increment('area_request_errors')
+                self.last_area_errors[area_number] = str(error)
+                self.log_message('Request for area %s failed! Text: %s' % (area_number, str(error)), level='error', area=area_number)
+            else:
+                area_responses.append((area_number, vessels))
+        return area_responses
+
+    def __get_adaptive_time_period(self, time_period, poll_start_time):
+        # Positions older than start of last successful poll were already received
+        if self.last_successful_poll_time is None:
+            return time_period
+        elapsed_minutes = int(math.ceil((poll_start_time - self.last_successful_poll_time) / 60.0))
+        adaptive_time_period = min(max(elapsed_minutes + self.time_period_margin, self.min_time_period), time_period)
+        self.log_message('Adaptive time period', time_period=adaptive_time_period)
+        return adaptive_time_period
+
+    def __get_traffic_simulator(self):
+        # Simulator is created on first emulated poll and keeps vessels moving between polls
+        if self.traffic_simulator is None:
+            bounds = None
+            if self.monitoring_areas:
+                bounds = {'x_min': min(area['bounds']['x_min'] for area in self.monitoring_areas),
+                          'x_max': max(area['bounds']['x_max'] for area in self.monitoring_areas),
+                          'y_min': min(area['bounds']['y_min'] for area in self.monitoring_areas),
+                          'y_max': max(area['bounds']['y_max'] for area in self.monitoring_areas)}
+            from MT_traffic_simulator import MT_traffic_simulator
+            self.traffic_simulator = MT_traffic_simulator(self.emulation_vessels, bounds=bounds, seed=self.emulation_seed)
+        return self.traffic_simulator
+
+    def __wait_request_slot(self):
+        if not self.min_request_interval:
+            return
+        with self.__request_lock:
+            delay = self.last_request_time + self.min_request_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.last_request_time = time.time()
 
     def __marine_traffic_vp_in_custom_area_request (self, timespan, MINLAT, MAXLAT, MINLON, MAXLON):
         #print '%s/%s/MINLAT:%s/MAXLAT:%s/MINLON:%s/MAXLON:%s/timespan:%s/protocol:jsono' % (self.MT_API_gate, self.MT_API_Key, MINLAT, MAXLAT, MINLON, MAXLON, timespan)
-        r_loaded = []
-        r = requests.get('%s/%s/MINLAT:%s/MAXLAT:%s/MINLON:%s/MAXLON:%s/timespan:%s/protocol:jsono' % (self.MT_API_gate, self.MT_API_Key, MINLAT, MAXLAT, MINLON, MAXLON, timespan))
-        r_loaded = json.loads(r.text)
-        #print r_loaded
-        return r_loaded
+        return self.__marine_traffic_request('%s/%s/MINLAT:%s/MAXLAT:%s/MINLON:%s/MAXLON:%s/timespan:%s/protocol:%s' %
+                                             (self.MT_API_gate, self.MT_API_Key, MINLAT, MAXLAT, MINLON, MAXLON, timespan, self.response_protocol))
 
     def __marine_traffic_vp_in_predifined_area_request(self, timespan):
         #print '%s/%s/timespan:%s/protocol:jsono' % (self.MT_API_gate, self.MT_API_Key, timespan)
-        r_loaded = []
-        r = requests.get('%s/%s/timespan:%s/protocol:jsono' % (self.MT_API_gate, self.MT_API_Key, timespan))
-        #print r.text
-        r_loaded = json.loads(r.text)
+        return self.__marine_traffic_request('%s/%s/timespan:%s/protocol:%s' %
+                                             (self.MT_API_gate, self.MT_API_Key, timespan, self.response_protocol))
+
+    def __marine_traffic_request(self, url):
+        # Returns iterable of vessels as raw dicts. In streaming mode it is generator reading response by chunks,
+        # shared response is read to list, so every monitor gets whole result
+        if self.request_coalescer is not None:
+            return self.request_coalescer.get(url, lambda: list(self.__fetch_marine_traffic(url)), self)
+        return self.__fetch_marine_traffic(url)
+
+    def __fetch_marine_traffic(self, url):
+        # In streaming mode fetch is time until response headers, body is read while it is parsed
+        if self.stream_responses:
+            with self.metrics.timer('stage_seconds', stage='fetch'):
+                r = self.transport.get(url, stream=True)
+            return MT_stream_parser.iter_response(r, self.response_protocol)
+
+        with self.metrics.timer('stage_seconds', stage='fetch'):
+            r = self.transport.get(url)
+        with self.metrics.timer('stage_seconds', stage='parse'):
+            if self.response_protocol == 'csv':
+                return list(MT_stream_parser.iter_csv_records(r.text.splitlines()))
+            r_loaded = json.loads(r.text)
         #print r_loaded
         return r_loaded
 
-
-    def __get_raw_vector_dataset_coordinates(self, fiona_dataset):
-        dataset_coordinates = []
-        for feature in fiona_dataset:
-            current_geometry_type = feature['geometry']['type']
-            if current_geometry_type != 'Polygon':
-                continue
-            dataset_coordinates.append(feature['geometry']['coordinates'][0])
-        return dataset_coordinates
-
-    def __get_reprojected_vector_dataset_coordinates (self, fiona_dataset, source_crs_epsg, dest_crs_epsg):
-        source = Proj(init=source_crs_epsg)
-        dest = Proj(init=dest_crs_epsg)
-        new_dataset = []
-
-        for feature in fiona_dataset:
-            new_feature_geometry = []
-            current_geometry_type = feature['geometry']['type']
-            if current_geometry_type != 'Polygon':
-                continue
-            current_geometry_coordinates = feature['geometry']['coordinates'][0]
-            for current_xy in current_geometry_coordinates:
-                source_x = current_xy[0]
-                source_y = current_xy[1]
-                dest_x, dest_y = transform(source, dest,source_x,source_y)
-                new_feature_geometry.append((dest_x,dest_y))
-            new_dataset.append(new_feature_geometry)
-
-        return new_dataset
-
-    def __reproject_point (self, x, y, source_crs_epsg, dest_crs_epsg):
-        source = Proj(init=source_crs_epsg)
-        dest = Proj(init=dest_crs_epsg)
-        dest_x, dest_y = transform(source, dest, x, y)
-        return dest_x, dest_y
-
-    def __get_bounds_from_coordinates(self, coordinates):
-        x_coords = [item[0] for item in coordinates]
-        y_coords = [item[1] for item in coordinates]
-        return ({'x_min': min(x_coords), 'x_max': max(x_coords), 'y_min': min(y_coords), 'y_max': max(y_coords)})
-
-    def __point_inside_polygon(self, point_x, point_y, polygon_coordinates):
-        point = Point((point_x,point_y))
-        polygon = shapely.geometry.Polygon(polygon_coordinates)
-        return polygon.contains(point)
-
-    def __add_feature_to_NGW_resource(self, feature, nextgis_web_api_options):
-        url = urljoin(nextgis_web_api_options['url'],'api/resource/%s/feature/' % nextgis_web_api_options['resource_id'])
-        r = requests.post(url, data=feature, auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
-
-        r_loaded = json.loads(r.text)
-        return r_loaded
+    def __reload_monitoring_areas(self):
+        # Source being rewritten could be unreadable for a moment, then old areas are kept till next poll
+        try:
+            monitoring_areas = self.area_loader.reload_if_changed()
+        except Exception as e:
+            self.log_message('Failed to reload monitoring areas! Text: %s' % str(e), level='error')
+            return
+        if monitoring_areas is None:
+            return
+        self.set_monitoring_areas(monitoring_areas)
+        self.log_message('Monitoring areas reloaded', areas=len(monitoring_areas),
+                         skipped_features=self.area_loader.skipped_features)
+
+    def __filter_vessels_by_areas(self, vessels, area_number=None, areas_with_index=None):
+        # Raw vessels are tested by coordinates, records are created only for vessels inside areas.
+        # Each vessel is tested only against candidate areas from index and returned once for overlapping areas.
+        # With area_number vessels are tested against this area only
+        # Time of getting vessels from response (reading and parsing in streaming mode) is counted as parse stage,
+        # the rest is filter stage
+        received_count = [0]
+        parse_time = [0.0]
+        filter_start_time = time.time()
+
+        def count_vessels(vessels):
+            vessels = iter(vessels)
+            while True:
+                next_start_time = time.time()
+                try:
+                    vessel = next(vessels)
+                except StopIteration:
+                    parse_time[0] += time.time() - next_start_time
+                    return
+                parse_time[0] += time.time() - next_start_time
+                received_count[0] += 1
+                yield vessel
+
+        get_x = lambda vessel: float(vessel['LON'])
+        get_y = lambda vessel: float(vessel['LAT'])
+
+        monitoring_areas, area_index = areas_with_index or self.monitoring_areas_with_index
+        if not monitoring_areas:
+            vessels_filtered = MT_vessel.from_records(count_vessels(vessels))
+        elif area_number is None:
+            vessels_filtered = MT_vessel.from_records(area_index.iter_inside(count_vessels(vessels), get_x, get_y,
+                                                                             vectorized=self.vectorized_filtering))
+        else:
+            vessels_filtered = MT_vessel.from_records(vessel for vessel in count_vessels(vessels)
+                                                      if area_index.area_contains(area_number, get_x(vessel), get_y(vessel)))
+
+        if self.stream_responses:
+            self.metrics.observe('stage_seconds', parse_time[0], stage='parse')
+        self.metrics.observe('stage_seconds', time.time() - filter_start_time - parse_time[0], stage='filter')
+        self.metrics.increment('vessels_received', received_count[0])
+        self.metrics.increment('vessels_filtered', len(vessels_filtered))
+        self.log_message('Received vessels', vessels=received_count[0], area=area_number)
+        return vessels_filtered
 
     def __delete_all_features_from_NGW_resource(self, nextgis_web_api_options):
         url = urljoin(nextgis_web_api_options['url'],'api/resource/%s/feature/' % nextgis_web_api_options['resource_id'])
-        r = requests.delete(url, auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
+        r = self.transport.delete(url, auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
         #print r.text
         r_loaded = json.loads(r.text)
         return r_loaded
 
     def __get_features_from_NGW_resource(self, nextgis_web_api_options):
         url = urljoin(nextgis_web_api_options['url'],'api/resource/%s/feature/' % nextgis_web_api_options['resource_id'])
-        r = requests.get(url, auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
-        #print r.text
-        r_loaded = json.loads(r.text)
-
-        return r_loaded
-
-    def __describe_vessel_for_NGW(self, vessel_record, crs_id='epsg:3857'):
-        x, y = self.__reproject_point(float(vessel_record['LON']), float(vessel_record['LAT']), 'epsg:4326', crs_id)
-        geom = 'POINT (%s %s)' % (x, y)
-        fields = vessel_record
-        feature = {'extensions':{'attachment': None, 'description': None}, 'fields': fields, 'geom': geom}
-        return json.dumps(feature)
+        r = self.transport.get(url, auth=(nextgis_web_api_options['user'], nextgis_web_api_options['password']))
+        if r.status_code != 200:
+            raise Exception('Failed to read features of NGW resource %s! HTTP %s: %s' %
+                            (nextgis_web_api_options['resource_id'], r.status_code, r.text[:500]))
+        return json.loads(r.text)
+
+    def __read_NGW_sync_state(self, nextgis_web_api_options):
+        # NGW drops fields missing in layer, so layers created without SHIP_ID field are synchronized by MMSI.
+        # Every feature has all fields of layer, so schema is known from any of them (empty layer has nothing to match)
+        features = self.__get_features_from_NGW_resource(nextgis_web_api_options)
+        key_field = 'SHIP_ID'
+        if features and 'SHIP_ID' not in features[0]['fields']:
+            if 'MMSI' not in features[0]['fields']:
+                raise Exception('NGW resource %s has neither SHIP_ID nor MMSI field, it can\'t be written in sync mode' %
+                                nextgis_web_api_options['resource_id'])
+            key_field = 'MMSI'
+            self.log_message('NGW resource has no SHIP_ID field, vessels are matched by MMSI', level='warning',
+                             resource_id=nextgis_web_api_options['resource_id'])
+
+        known_vessels = {}
+        duplicate_ids = []
+        for feature in features:
+            key = feature['fields'].get(key_field)
+            if key in known_vessels or not key:
+                duplicate_ids.append(feature['id'])
+                continue
+            known_vessels[key] = {'id': feature['id'], 'LAT': feature['fields'].get('LAT'), 'LON': feature['fields'].get('LON')}
+        return {'key_field': key_field, 'vessels': known_vessels}, duplicate_ids
+
+    def __sync_vessels_to_NGW_resource(self, vessels, nextgis_web_api_options, writer):
+        # State is {'key_field': 'SHIP_ID' or 'MMSI', 'vessels': key -> {'id': NGW feature id, 'LAT', 'LON'}}
+        # for every resource written in sync mode
+        state_key = (nextgis_web_api_options['url'], nextgis_web_api_options['resource_id'])
+        sync_state = self.NGW_sync_state.get(state_key)
+        duplicate_ids = []
+        if sync_state is None:
+            sync_state, duplicate_ids = self.__read_NGW_sync_state(nextgis_web_api_options)
+        key_field = sync_state['key_field']
+        known_vessels = sync_state['vessels']
+
+        current_vessels = {}
+        for vessel in vessels:
+            if vessel[key_field]:
+                current_vessels[vessel[key_field]] = vessel
+
+        inserted_vessels = []
+        updated_vessels = []
+        for key, vessel in current_vessels.items():
+            known_vessel = known_vessels.get(key)
+            if known_vessel is None:
+                inserted_vessels.append(vessel)
+            elif known_vessel['LAT'] != vessel['LAT'] or known_vessel['LON'] != vessel['LON']:
+                updated_vessels.append(vessel)
+        removed_keys = [key for key in known_vessels if key not in current_vessels]
+
+        self.log_message('NGW sync', inserted=len(inserted_vessels), updated=len(updated_vessels),
+                         deleted=len(removed_keys) + len(duplicate_ids))
+
+        features = self.__describe_vessels_for_NGW(inserted_vessels + updated_vessels)
+        for feature, vessel in zip(features[len(inserted_vessels):], updated_vessels):
+            feature['id'] = known_vessels[vessel[key_field]]['id']
+        feature_ids, failed_chunks = writer.write_features(features)
+
+        # Vessels from failed chunks keep previous state and will be sent again next time
+        for vessel, feature_id in zip(inserted_vessels + updated_vessels, feature_ids):
+            if feature_id is not None:
+                known_vessels[vessel[key_field]] = {'id': feature_id, 'LAT': vessel['LAT'], 'LON': vessel['LON']}
+
+        deleted_ids, failed_delete_chunks = writer.delete_features([known_vessels[key]['id'] for key in removed_keys] +
+                                                                   duplicate_ids)
+        for key, deleted_id in zip(removed_keys, deleted_ids):
+            if deleted_id is not None:
+                del known_vessels[key]
+        failed_chunks += failed_delete_chunks
+
+        if failed_chunks:
+            # Resource could be changed by somebody else, so correspondence is read again on next call
+            self.NGW_sync_state.pop(state_key, None)
+        else:
+            self.NGW_sync_state[state_key] = sync_state
+        return failed_chunks
+
+    def __describe_vessels_for_file(self, vessels, output_crs='epsg:4326'):
+        records = []
+        xs, ys = MT_transform.transform_points([vessel.lon for vessel in vessels],
+                                               [vessel.lat for vessel in vessels],
+                                               'epsg:4326', output_crs)
+        for vessel, x, y in zip(vessels, xs, ys):
+            properties = dict((name, vessel.get_string(name)) for name in MT_vessel.fields)
+            records.append({'geometry': {'type': 'Point', 'coordinates': (float(x), float(y))}, 'properties': properties})
+        return records
+
+    def __append_vessels_to_geojson(self, vessels, output_file, output_crs):
+        # Closing brackets of FeatureCollection are overwritten with new features and written again.
+        # False is returned if file doesn't end as FeatureCollection written by GDAL, then Fiona appends.
+        # New features and brackets are written in one call over the old tail, which is restored if writing fails
+        records = self.__describe_vessels_for_file(vessels, output_crs)
+        if not records:
+            return True
+        with open(output_file, 'rb+') as fl:
+            fl.seek(0, os.SEEK_END)
+            file_size = fl.tell()
+            tail_start = max(file_size - 256, 0)
+            fl.seek(tail_start)
+            tail = fl.read()
+            tail_match = re.search(br'([\[}])\s*\]\s*}\s*$', tail)
+            if tail_match is None:
+                return False
+            features = ',\n'.join(json.dumps({'type': 'Feature', 'properties': record['properties'],
+                                               'geometry': {'type': 'Point', 'coordinates': list(record['geometry']['coordinates'])}})
+                                   for record in records)
+            separator = ',\n' if tail_match.group(1) == b'}' else '\n'
+            append_start = tail_start + tail_match.end(1)
+            try:
+                fl.seek(append_start)
+                fl.write(('%s%s\n]\n}\n' % (separator, features)).encode('utf-8'))
+                fl.truncate()
+                fl.flush()
+                os.fsync(fl.fileno())
+            except BaseException:
+                fl.seek(append_start)
+                fl.truncate()
+                fl.write(tail[tail_match.end(1):])
+                fl.flush()
+                raise
+        return True
+
+    def __append_vessels_with_file_copy(self, vessels, output_file, output_type, output_schema, output_crs):
+        # Fallback for drivers without append support. Features are copied one by one, not loaded at once,
+        # and output file is replaced only after temporary file is completely written
+        import fiona
+        temp_file = '%s.tmp%s' % os.path.splitext(output_file)
+        field_names = list(output_schema['properties'].keys())
+        try:
+            with fiona.open(output_file, 'r') as input:
+                with fiona.open(temp_file, 'w', driver=output_type, schema=output_schema, crs=self.__get_fiona_crs(output_crs)) as output:
+                    # Drivers could add own fields on reading (i.e. gml_id), only vessel fields are copied
+                    output.writerecords({'geometry': feature['geometry'],
+                                         'properties': dict((name, feature['properties'].get(name)) for name in field_names)}
+                                        for feature in input)
+                    output.writerecords(self.__describe_vessels_for_file(vessels, output_crs))
+        except Exception:
+            for temp_part in self.__get_dataset_files(temp_file):
+                os.remove(temp_part)
+            raise
+
+        # Some drivers write sidecar files (i.e. GML schema), they are moved together with main file
+        output_root = os.path.splitext(output_file)[0]
+        temp_root = os.path.splitext(temp_file)[0]
+        for temp_part in self.__get_dataset_files(temp_file):
+            output_part = output_root + temp_part[len(temp_root):]
+            if os.path.exists(output_part):
+                os.remove(output_part)
+            os.rename(temp_part, output_part)
+
+    def __get_fiona_crs(self, crs_epsg):
+        from fiona.crs import from_epsg
+        return from_epsg(int(str(crs_epsg).split(':')[-1]))
+
+    def __get_dataset_files(self, dataset_file):
+        dataset_root = os.path.splitext(os.path.basename(dataset_file))[0]
+        dataset_dir = os.path.dirname(dataset_file)
+        return [os.path.join(dataset_dir, file_name) for file_name in os.listdir(dataset_dir or '.')
+                if os.path.splitext(file_name)[0] == dataset_root]
+
+    def __adapt_records_to_fields(self, records, field_names):
+        # Drivers could shorten field names (i.e. to 10 characters in Shapefile), so vessel fields are matched by prefix
+        if not records or set(records[0]['properties'].keys()) == set(field_names):
+            return records
+        names_mapping = {}
+        for name in records[0]['properties'].keys():
+            for field_name in field_names:
+                if name == field_name or name.startswith(field_name):
+                    names_mapping[name] = field_name
+                    break
+        return [{'geometry': record['geometry'],
+                 'properties': dict((names_mapping[name], value) for name, value in record['properties'].items()
+                                    if name in names_mapping)}
+                for record in records]
+
+    def __describe_vessels_for_NGW(self, vessel_records, crs_id='epsg:3857'):
+        # All vessels are reprojected in one call, serialization is done by writer once per chunk
+        if not vessel_records:
+            return []
+        xs, ys = MT_transform.transform_points([vessel_record.lon for vessel_record in vessel_records],
+                                               [vessel_record.lat for vessel_record in vessel_records],
+                                               'epsg:4326', crs_id)
+        return [{'extensions': {'attachment': None, 'description': None},
+                 'fields': vessel_record.as_dict(),
+                 'geom': 'POINT (%s %s)' % (x, y)}
+                for vessel_record, x, y in zip(vessel_records, xs, ys)]
 
     def __compare_features_are_equal(self, feature1, feature2):
         # Maybe some more deep comparison?
@@ -82,6 +82,10 @@ class MT_NGW_init_schemes():
                         "keyname": "LON",
                         "datatype": "STRING"
                     },
+                    {
+                        "keyname": "SHIP_ID",
+                        "datatype": "STRING"
+                    },
                     {
                         "keyname": "MMSI",
                         "datatype": "STRING"
@@ -132,8 +136,47 @@ class MT_NGW_init_schemes():
 
         return json.dumps(resource)
 
+    def get_init_track_layer(self):
+        resource = {
+            'resource':
+                {'cls': 'vector_layer',
+                 'parent': {
+                     'id': self.parent_id
+                 },
+                 'display_name': self.display_name,
+                 'keyname': self.keyname,
+                 'description': 'Vessel tracks from MarineTraffic.com'
+                 },
+            'resmeta':
+                {'items':
+                     {}
+                 },
+            'vector_layer': {
+                'srs': {'id': 3857},
+                'geometry_type': 'LINESTRING',
+                'fields': [
+                    {
+                        'keyname': 'SHIP_ID',
+                        'datatype': "STRING"
+                    },
+                    {
+                        "keyname": "MMSI",
+                        "datatype": "STRING"
+                    },
+                    {
+                        "keyname": "START_TIME",
+                        "datatype": "STRING"
+                    },
+                    {
+                        "keyname": "END_TIME",
+                        "datatype": "STRING"
+                    },
+                    {
+                        "keyname": "POINTS",
+                        "datatype": "STRING"
+                    }
+                ]
+            }
+        }
 
-
-
-
-
+        return json.dumps(resource)
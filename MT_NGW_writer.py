@@ -0,0 +1,113 @@
+# coding=utf-8
+
+import json
+from multiprocessing.pool import ThreadPool
+from requests.compat import urljoin
+
+
+class MT_NGW_writer():
+    """
+    Batched writer of features to NextGIS Web vector resource.
+
+    Features are sent in chunks through bulk feature endpoint (PATCH of feature collection
+    for creation and update, DELETE with list of ids for deletion), several chunks at once.
+    Failed chunks are reported, successful chunks are kept.
+    """
+
+    default_chunk_size = 500
+    default_parallel_chunks = 2
+
+    def __init__(self, nextgis_web_api_options, transport, chunk_size=None, parallel_chunks=None):
+        """
+        nextgis_web_api_options - dictionary, containing all information about NGW connection. Keys are:
+        1. 'user' - NGW username (i.e. administrator)
+        2. 'password' - NGW password
+        3. 'url' - NGW url (i.e. http://ekazakov.nextgis.com/)
+        4. 'resource_id' - id of resource, where vessels vector data are stored (i.e. 25)
+
+        :param nextgis_web_api_options: All necessary API options
+        :type nextgis_web_api_options: dict
+
+        :param transport: HTTP transport
+        :type transport: MT_transport
+
+        :param chunk_size: Number of features in one request
+        :type chunk_size: int
+
+        :param parallel_chunks: Number of chunks uploaded at once
+        :type parallel_chunks: int
+        """
+        self.nextgis_web_api_options = nextgis_web_api_options
+        self.transport = transport
+        self.chunk_size = chunk_size or self.default_chunk_size
+        self.parallel_chunks = parallel_chunks or self.default_parallel_chunks
+        self.features_url = urljoin(nextgis_web_api_options['url'],
+                                    'api/resource/%s/feature/' % nextgis_web_api_options['resource_id'])
+        self.auth = (nextgis_web_api_options['user'], nextgis_web_api_options['password'])
+
+    def write_features(self, features):
+        """
+        Create features (and update ones having 'id') in chunks
+
+        :param features: Features in NGW API format: {'fields': {...}, 'geom': 'WKT', 'extensions': {...}}
+        :type features: list
+
+        :return: tuple (ids of written features in order of input, list of failed chunks).
+        Failed chunk is dict {'chunk': number, 'start': position of first feature, 'size': size, 'error': text},
+        ids of its features are None
+        """
+        def write_chunk(chunk):
+            r = self.transport.patch(self.features_url, data=json.dumps(chunk), auth=self.auth)
+            if r.status_code != 200:
+                raise Exception('HTTP %s: %s' % (r.status_code, r.text[:500]))
+            return [item.get('id') for item in json.loads(r.text)]
+
+        return self.__process_in_chunks(features, write_chunk)
+
+    def delete_features(self, feature_ids):
+        """
+        Delete features by ids in chunks
+
+        :param feature_ids: NGW ids of features
+        :type feature_ids: list
+
+        :return: tuple (list of deleted ids, None for ids of failed chunks; list of failed chunks)
+        """
+        def delete_chunk(chunk):
+            r = self.transport.delete(self.features_url, data=json.dumps([{'id': feature_id} for feature_id in chunk]),
+                                      auth=self.auth)
+            if r.status_code != 200:
+                raise Exception('HTTP %s: %s' % (r.status_code, r.text[:500]))
+            return chunk
+
+        return self.__process_in_chunks(feature_ids, delete_chunk)
+
+    def __process_in_chunks(self, items, process_chunk):
+        chunks = [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)]
+        if not chunks:
+            return [], []
+
+        def run_chunk(chunk_number):
+            try:
+                return chunk_number, process_chunk(chunks[chunk_number]), None
+            except Exception as e:
+                return chunk_number, None, str(e)
+
+        pool = ThreadPool(max(1, min(self.parallel_chunks, len(chunks))))
+        try:
+            results = pool.map(run_chunk, range(len(chunks)))
+        finally:
+            pool.close()
+            pool.join()
+
+        processed = []
+        failed_chunks = []
+        for chunk_number, chunk_result, error in results:
+            if error is not None:
+                chunk_result = [None] * len(chunks[chunk_number])
+                failed_chunks.append({'chunk': chunk_number,
+                                      'start': chunk_number * self.chunk_size,
+                                      'size': len(chunks[chunk_number]),
+                                      'error': error})
+            processed.extend(chunk_result)
+        return processed, failed_chunks
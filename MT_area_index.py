@@ -0,0 +1,183 @@
+# coding=utf-8
+
+from operator import attrgetter
+import shapely
+from shapely.geometry import Polygon
+from shapely.geometry import Point
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+
+# Batch filtering needs shapely 2 vectorized API and NumPy, otherwise scalar path is used
+VECTORIZED_FILTERING_AVAILABLE = SHAPELY_2 and numpy is not None
+
+
+class MT_area_index():
+    """
+    Spatial index over monitoring areas.
+
+    Polygons are built once, prepared for fast repeated predicates and put behind STRtree,
+    so each point is tested only against areas whose bounds contain it.
+    """
+
+    tree = None
+    default_batch_size = 10000
+
+    def __init__(self, areas_geometries):
+        """
+        :param areas_geometries: Areas in EPSG:4326, one per area: shapely geometries (Polygon or MultiPolygon,
+        holes are respected), GeoJSON-like geometry dicts or polygon exterior rings
+        :type areas_geometries: list
+        """
+        self.polygons = [self.__get_geometry(geometry) for geometry in areas_geometries]
+        self.prepared_polygons = [prep(polygon) for polygon in self.polygons]
+        self.__area_number_by_geometry_id = dict((id(polygon), number) for number, polygon in enumerate(self.polygons))
+
+        if self.polygons:
+            if SHAPELY_2:
+                shapely.prepare(self.polygons)
+            self.tree = STRtree(self.polygons)
+
+    def __len__(self):
+        return len(self.polygons)
+
+    @staticmethod
+    def __get_geometry(geometry):
+        if isinstance(geometry, BaseGeometry):
+            return geometry
+        if isinstance(geometry, dict):
+            return shape(geometry)
+        return Polygon(geometry)
+
+    def candidate_areas(self, point_x, point_y):
+        """
+        Numbers of areas whose bounding boxes contain the point
+
+        :return: list of area numbers (positions in monitoring_areas)
+        """
+        if self.tree is None:
+            return []
+
+        candidates = self.tree.query(Point(point_x, point_y))
+        if SHAPELY_2:
+            return [int(number) for number in candidates]
+        return [self.__area_number_by_geometry_id[id(geometry)] for geometry in candidates]
+
+    def areas_containing(self, point_x, point_y):
+        """
+        Numbers of all areas containing the point
+
+        :return: list of area numbers (positions in monitoring_areas)
+        """
+        point = Point(point_x, point_y)
+        return [number for number in self.candidate_areas(point_x, point_y)
+                if self.prepared_polygons[number].contains(point)]
+
+    def contains(self, point_x, point_y):
+        """
+        Check if point is inside any of areas. Point is tested once, even if areas overlap.
+
+        :return: bool
+        """
+        point = Point(point_x, point_y)
+        for number in self.candidate_areas(point_x, point_y):
+            if self.prepared_polygons[number].contains(point):
+                return True
+        return False
+
+    def area_contains(self, area_number, point_x, point_y):
+        """
+        Check if point is inside one certain area
+
+        :return: bool
+        """
+        return self.prepared_polygons[area_number].contains(Point(point_x, point_y))
+
+    def contains_mask(self, points_x, points_y):
+        """
+        Vectorized check of many points against all areas in one call
+
+        :param points_x: Longitudes of points
+        :type points_x: numpy.ndarray
+
+        :param points_y: Latitudes of points
+        :type points_y: numpy.ndarray
+
+        :return: numpy boolean mask, True for points inside any of areas
+        """
+        mask = numpy.zeros(len(points_x), dtype=bool)
+        if self.tree is None or not len(points_x):
+            return mask
+
+        points = shapely.points(points_x, points_y)
+        point_numbers, area_numbers = self.tree.query(points, predicate='within')
+        mask[point_numbers] = True
+        return mask
+
+    def filter_vessels(self, vessels, vectorized=True):
+        """
+        Select vessels located inside any of areas. Vessel is returned once, even if areas overlap.
+
+        If vectorized is True and shapely 2 with NumPy are available, whole list is tested in one batch call,
+        otherwise every vessel is tested separately.
+
+        :param vessels: Vessels with parsed coordinates
+        :type vessels: list of MT_vessel
+
+        :param vectorized: Use batch filtering if available
+        :type vectorized: bool
+
+        :return: filtered list of vessels
+        """
+        return list(self.iter_inside(vessels, attrgetter('lon'), attrgetter('lat'),
+                                     vectorized=vectorized, batch_size=max(len(vessels), 1)))
+
+    def iter_inside(self, items, get_x, get_y, vectorized=True, batch_size=None):
+        """
+        Yield items located inside any of areas. Items could be any iterable, i.e. generator of streamed response.
+        In vectorized mode items are tested by batches of batch_size.
+
+        :param items: Iterable of objects with coordinates
+        :param get_x: Function returning longitude of item
+        :param get_y: Function returning latitude of item
+
+        :param vectorized: Use batch filtering if available
+        :type vectorized: bool
+
+        :param batch_size: Number of items tested in one vectorized call
+        :type batch_size: int
+
+        :return: generator of items inside areas
+        """
+        if not (vectorized and VECTORIZED_FILTERING_AVAILABLE):
+            for item in items:
+                if self.contains(get_x(item), get_y(item)):
+                    yield item
+            return
+
+        batch_size = batch_size or self.default_batch_size
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                for inside_item in self.__filter_batch(batch, get_x, get_y):
+                    yield inside_item
+                batch = []
+        for inside_item in self.__filter_batch(batch, get_x, get_y):
+            yield inside_item
+
+    def __filter_batch(self, batch, get_x, get_y):
+        if not batch:
+            return []
+        points_x = numpy.fromiter((get_x(item) for item in batch), dtype=float, count=len(batch))
+        points_y = numpy.fromiter((get_y(item) for item in batch), dtype=float, count=len(batch))
+        mask = self.contains_mask(points_x, points_y)
+        return [item for item, inside in zip(batch, mask) if inside]
@@ -0,0 +1,185 @@
+# coding=utf-8
+
+import os
+import json
+import hashlib
+from shapely import wkb
+from shapely.geometry import shape
+from MT_transform import MT_transform
+
+
+class MT_area_loader():
+    """
+    Loader of monitoring areas from OGR data source.
+
+    Every Polygon or MultiPolygon feature (with holes) becomes one area, reprojected to EPSG:4326
+    and optionally simplified. Areas are dicts with 'id' (feature id), 'geometry' (shapely geometry)
+    and 'bounds' (x_min, x_max, y_min, y_max). Features of other geometry types are skipped.
+
+    If cache_dir is given, prepared areas are saved there as WKB keyed by hash of source files
+    and simplification tolerance, so next start with the same source doesn't read and reproject it again.
+    Changes of source files are detected by reload_if_changed: modification times and sizes are checked
+    on every call, content hash is computed only if they differ.
+    """
+
+    cache_version = 1
+
+    def __init__(self, source, simplify_tolerance=None, cache_dir=None):
+        """
+        :param source: Path to OGR data source (any CRS with EPSG code)
+        :type source: str
+
+        :param simplify_tolerance: Tolerance of simplification in degrees, no simplification by default
+        :type simplify_tolerance: float
+
+        :param cache_dir: Directory for cache of prepared areas, no cache by default
+        :type cache_dir: str
+        """
+        self.source = source
+        self.simplify_tolerance = simplify_tolerance
+        self.cache_dir = cache_dir
+        self.source_state = None
+        self.source_hash = None
+        self.skipped_features = 0
+        self.loaded_from_cache = False
+
+    def load(self):
+        """
+        Load areas from cache if source wasn't changed since it was written, otherwise from source
+
+        :return: list of areas
+        """
+        source_state = self.__get_source_state()
+        source_hash = self.__get_source_hash()
+
+        areas = self.__read_cache(source_hash)
+        self.loaded_from_cache = areas is not None
+        if areas is None:
+            areas = self.__read_source()
+            self.__write_cache(source_hash, areas)
+
+        self.source_state = source_state
+        self.source_hash = source_hash
+        return areas
+
+    def reload_if_changed(self):
+        """
+        Load areas again if source files were changed since last load
+
+        :return: list of areas or None if source wasn't changed
+        """
+        source_state = self.__get_source_state()
+        if source_state is None or source_state == self.source_state:
+            return None
+        # Files could be touched or rewritten with the same content
+        if self.__get_source_hash() == self.source_hash:
+            self.source_state = source_state
+            return None
+        return self.load()
+
+    def __get_source_files(self):
+        # Dataset could consist of several files with the same name (i.e. shp, shx, dbf, prj)
+        if not os.path.isfile(self.source):
+            return []
+        source_root = os.path.splitext(os.path.basename(self.source))[0]
+        source_dir = os.path.dirname(self.source)
+        return sorted(os.path.join(source_dir, file_name) for file_name in os.listdir(source_dir or '.')
+                      if os.path.splitext(file_name)[0] == source_root)
+
+    def __get_source_state(self):
+        # None for sources which are not local files (i.e. URL or database), they are never reloaded or cached
+        source_files = self.__get_source_files()
+        if not source_files:
+            return None
+        return [(file_name, os.path.getmtime(file_name), os.path.getsize(file_name)) for file_name in source_files]
+
+    def __get_source_hash(self):
+        source_files = self.__get_source_files()
+        if not source_files:
+            return None
+        source_hash = hashlib.sha1(('%s:%r' % (self.cache_version, self.simplify_tolerance)).encode('utf-8'))
+        for file_name in source_files:
+            source_hash.update(os.path.basename(file_name).encode('utf-8'))
+            with open(file_name, 'rb') as fl:
+                for chunk in iter(lambda: fl.read(1024 * 1024), b''):
+                    source_hash.update(chunk)
+        return source_hash.hexdigest()
+
+    def __read_source(self):
+        # Fiona is needed only when source is read, not when areas are taken from cache
+        import fiona
+        areas = []
+        self.skipped_features = 0
+        with fiona.open(self.source) as source_dataset:
+            source_crs = self.__get_source_crs(source_dataset)
+            for feature in source_dataset:
+                geometry = feature['geometry']
+                if geometry is None or geometry['type'] not in ['Polygon', 'MultiPolygon']:
+                    self.skipped_features += 1
+                    continue
+                geometry = shape(self.__reproject_geometry(geometry, source_crs, 'epsg:4326'))
+                if not geometry.is_valid:
+                    geometry = geometry.buffer(0)
+                if self.simplify_tolerance:
+                    geometry = geometry.simplify(self.simplify_tolerance, preserve_topology=True)
+                if geometry.is_empty:
+                    self.skipped_features += 1
+                    continue
+                areas.append(self.__describe_area(feature['id'], geometry))
+        return areas
+
+    def __get_source_crs(self, source_dataset):
+        source_crs = source_dataset.crs
+        if 'init' in source_crs:
+            return source_crs['init']
+        return 'epsg:%s' % source_crs.to_epsg()
+
+    def __reproject_geometry(self, geometry, source_crs, dest_crs):
+        # Rings are transformed as whole arrays, exterior ring and holes of every polygon
+        def reproject_polygon(rings):
+            return [MT_transform.transform_coordinates(ring, source_crs, dest_crs) for ring in rings]
+
+        if geometry['type'] == 'Polygon':
+            coordinates = reproject_polygon(geometry['coordinates'])
+        else:
+            coordinates = [reproject_polygon(polygon) for polygon in geometry['coordinates']]
+        return {'type': geometry['type'], 'coordinates': coordinates}
+
+    def __describe_area(self, area_id, geometry):
+        x_min, y_min, x_max, y_max = geometry.bounds
+        return {'id': area_id, 'geometry': geometry,
+                'bounds': {'x_min': x_min, 'x_max': x_max, 'y_min': y_min, 'y_max': y_max}}
+
+    def __get_cache_file(self, source_hash):
+        return os.path.join(self.cache_dir, 'areas_%s.json' % source_hash)
+
+    def __read_cache(self, source_hash):
+        if not self.cache_dir or source_hash is None:
+            return None
+        cache_file = self.__get_cache_file(source_hash)
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file) as fl:
+                cache = json.load(fl)
+            return [self.__describe_area(area['id'], wkb.loads(area['wkb'], hex=True)) for area in cache['areas']]
+        except (ValueError, KeyError):
+            # Broken cache is ignored and rewritten
+            return None
+
+    def __write_cache(self, source_hash, areas):
+        if not self.cache_dir or source_hash is None:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        cache = {'source': self.source,
+                 'simplify_tolerance': self.simplify_tolerance,
+                 'areas': [{'id': area['id'], 'wkb': wkb.dumps(area['geometry'], hex=True)} for area in areas]}
+        cache_file = self.__get_cache_file(source_hash)
+        # Cache is written to temporary file first, so other process never reads half-written cache
+        temp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+        with open(temp_file, 'w') as fl:
+            json.dump(cache, fl)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        os.rename(temp_file, cache_file)
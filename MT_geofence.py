@@ -0,0 +1,179 @@
+# coding=utf-8
+
+import json
+import time
+import threading
+from MT_history import MT_history_store
+from MT_vessel import MT_vessel
+
+
+class MT_geofence_engine():
+    """
+    Incremental detector of vessels entering and leaving monitoring areas.
+
+    Engine keeps membership of every vessel in every area and turns results of MTMonitor.get_vessels
+    into events, so output is proportional to changes, not to number of vessels:
+    - 'enter': vessel is seen inside area it wasn't inside before
+    - 'exit': vessel is seen outside area it was inside, or isn't seen inside any area for exit_timeout minutes
+      (then event has 'lost': True, vessel could have left all areas or stopped reporting)
+    - 'dwell': vessel is inside area for dwell_time minutes, once per visit
+
+    Durations are measured by TIMESTAMP of positions. Events are dicts with keys: event, area_id, ship_id, mmsi,
+    time, lon, lat (position of event), enter_time, duration (seconds since entering, for exit and dwell), lost.
+    """
+
+    default_exit_timeout = 10  # In minutes
+
+    def __init__(self, dwell_time=None, exit_timeout=None):
+        """
+        :param dwell_time: Time in minutes inside area to emit 'dwell' event, no dwell events by default
+        :type dwell_time: float
+
+        :param exit_timeout: Time in minutes after which vessel not seen inside any area is considered gone (10 by default)
+        :type exit_timeout: float
+        """
+        self.dwell_time = dwell_time
+        self.exit_timeout = exit_timeout if exit_timeout is not None else self.default_exit_timeout
+
+        # Areas of every vessel as {vessel key: {area id: membership}}, only vessels inside areas are kept
+        self.memberships = {}
+        self.last_seen = {}
+        self.__areas = None
+        self.__area_index = None
+
+    def __len__(self):
+        return len(self.memberships)
+
+    def update(self, vessels, areas, area_index=None, update_time=None):
+        """
+        Check positions of vessels against areas
+
+        :param vessels: Vessels as returned by MTMonitor.get_vessels (positions of several polls are allowed)
+        :type vessels: list of MT_vessel
+
+        :param areas: Monitoring areas, area id is 'id' of area or its number
+        :type areas: list
+
+        :param area_index: Index over the same areas (i.e. both from MTMonitor.monitoring_areas_with_index),
+        built by engine by default
+        :type area_index: MT_area_index
+
+        :return: list of events ordered by time of positions
+        """
+        if update_time is None:
+            update_time = time.time()
+        area_index = self.__get_area_index(areas, area_index)
+
+        events = []
+        positions = [vessel for vessel in MT_vessel.from_records(vessels)
+                     if vessel.key and vessel.lat is not None and vessel.lon is not None]
+        # Positions of coalesced polls are checked in order, so short visits are not lost
+        positions.sort(key=lambda vessel: vessel.timestamp or '')
+        for vessel in positions:
+            position_time = MT_history_store.parse_time(vessel.timestamp) or int(update_time)
+            area_ids = set(areas[number].get('id', number) for number in area_index.areas_containing(vessel.lon, vessel.lat))
+            memberships = self.memberships.get(vessel.key, {})
+
+            for area_id in list(memberships.keys()):
+                if area_id not in area_ids:
+                    events.append(self.__describe_event('exit', area_id, vessel, position_time, memberships.pop(area_id)))
+            for area_id in area_ids:
+                membership = memberships.get(area_id)
+                if membership is None:
+                    membership = memberships[area_id] = {'enter_time': position_time, 'dwell': False}
+                    events.append(self.__describe_event('enter', area_id, vessel, position_time, membership))
+                membership['vessel'] = vessel
+                membership['time'] = position_time
+                if self.dwell_time is not None and not membership['dwell'] and \
+                        position_time - membership['enter_time'] >= self.dwell_time * 60:
+                    membership['dwell'] = True
+                    events.append(self.__describe_event('dwell', area_id, vessel, position_time, membership))
+
+            if memberships:
+                self.memberships[vessel.key] = memberships
+                self.last_seen[vessel.key] = update_time
+            else:
+                self.memberships.pop(vessel.key, None)
+                self.last_seen.pop(vessel.key, None)
+
+        events.extend(self.__expire(update_time))
+        return events
+
+    def __expire(self, update_time):
+        events = []
+        expiration_time = update_time - self.exit_timeout * 60.0
+        for key in [key for key, last_seen in self.last_seen.items() if last_seen < expiration_time]:
+            for area_id, membership in self.memberships.pop(key).items():
+                events.append(self.__describe_event('exit', area_id, membership['vessel'], membership['time'], membership,
+                                                    lost=True))
+            del self.last_seen[key]
+        return events
+
+    def __get_area_index(self, areas, area_index):
+        if area_index is not None:
+            return area_index
+        if areas is not self.__areas:
+            from MT_area_index import MT_area_index
+            self.__areas = areas
+            self.__area_index = MT_area_index([area['geometry'] for area in areas])
+        return self.__area_index
+
+    def __describe_event(self, event, area_id, vessel, position_time, membership, lost=False):
+        return {'event': event,
+                'area_id': area_id,
+                'ship_id': vessel.ship_id,
+                'mmsi': vessel.mmsi,
+                'time': MT_history_store.format_time(position_time),
+                'lon': vessel.lon,
+                'lat': vessel.lat,
+                'enter_time': MT_history_store.format_time(membership['enter_time']),
+                'duration': position_time - membership['enter_time'] if event != 'enter' else 0,
+                'lost': lost}
+
+
+class MT_event_sink():
+    """
+    Base class of destination for geofence events. Subclass must implement write_events(events).
+    """
+
+    name = 'events'
+
+    def write_events(self, events):
+        """
+        :param events: Events of one update (see MT_geofence_engine)
+        :type events: list of dict
+        """
+        raise NotImplementedError
+
+
+class MT_jsonl_event_sink(MT_event_sink):
+    """
+    Sink appending events to file as JSON lines
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.name = 'events:%s' % output_file
+        self.__lock = threading.Lock()
+
+    def write_events(self, events):
+        with self.__lock:
+            with open(self.output_file, 'a') as fl:
+                for event in events:
+                    fl.write(json.dumps(event) + '\n')
+
+
+class MT_callback_event_sink(MT_event_sink):
+    """
+    Sink passing events to function, i.e. to message queue client
+    """
+
+    def __init__(self, callback, name=None):
+        """
+        :param callback: Function taking list of events
+        """
+        self.callback = callback
+        self.name = name or 'events:%s' % getattr(callback, '__name__', 'callback')
+
+    def write_events(self, events):
+        self.callback(events)
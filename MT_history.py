@@ -0,0 +1,224 @@
+# coding=utf-8
+
+import os
+import re
+import time
+import sqlite3
+import calendar
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from MT_vessel import MT_vessel
+
+
+class MT_history_store():
+    """
+    Store of vessel positions history, partitioned by day.
+
+    Every day (by TIMESTAMP of position) is a separate SQLite file positions_YYYYMMDD.sqlite in directory.
+    Positions are kept in typed columns (time as integer unix seconds, coordinates as REAL, codes as INTEGER),
+    indexed by SHIP_ID, MMSI and time, and by coordinates in R-tree (if SQLite is built with R-tree module).
+    The same position (vessel and TIMESTAMP) is written once, so overlapping requests do not duplicate history.
+
+    Queries read only partitions of requested days.
+    """
+
+    partition_prefix = 'positions_'
+    partition_extension = '.sqlite'
+    max_open_partitions = 4
+
+    columns = ('t', 'ship_id', 'mmsi', 'imo', 'lat', 'lon', 'speed', 'heading', 'course', 'status', 'dsrc',
+               'utc_seconds', 'request_time')
+
+    def __init__(self, directory, max_open_partitions=None):
+        """
+        :param directory: Directory for partition files, created if not exists
+        :type directory: str
+
+        :param max_open_partitions: Number of partitions kept open between writes and queries
+        :type max_open_partitions: int
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if max_open_partitions:
+            self.max_open_partitions = max_open_partitions
+
+        self.connections = OrderedDict()
+        self.rtree_available = True
+        self.__lock = threading.RLock()
+
+    def write(self, vessels):
+        """
+        Add positions to history
+
+        :param vessels: Vessels as returned by MTMonitor.get_vessels
+        :type vessels: list of MT_vessel
+
+        :return: number of added positions (already known positions are not counted)
+        """
+        rows_by_day = {}
+        for vessel in MT_vessel.from_records(vessels):
+            if vessel.lat is None or vessel.lon is None or not vessel.key:
+                continue
+            position_time = self.parse_time(vessel.timestamp or vessel.request_time) or int(time.time())
+            request_time = self.parse_time(vessel.request_time)
+            row = (position_time, vessel.ship_id, vessel.mmsi, vessel.imo, vessel.lat, vessel.lon, vessel.speed,
+                   vessel.heading, vessel.course, vessel.status, vessel.dsrc, vessel.utc_seconds, request_time)
+            day = time.strftime('%Y%m%d', time.gmtime(position_time))
+            rows_by_day.setdefault(day, []).append(row)
+
+        added = 0
+        with self.__lock:
+            for day in sorted(rows_by_day):
+                connection = self.__get_partition(day, create=True)
+                with connection:
+                    cursor = connection.executemany('INSERT OR IGNORE INTO positions (%s) VALUES (%s)' %
+                                                    (', '.join(self.columns), ', '.join('?' * len(self.columns))),
+                                                    rows_by_day[day])
+                    added += cursor.rowcount
+        return added
+
+    def query(self, ship_id=None, mmsi=None, start_time=None, end_time=None, bbox=None):
+        """
+        Positions from history ordered by time
+
+        :param ship_id: SHIP_ID of vessel
+        :type ship_id: str
+
+        :param mmsi: MMSI of vessel
+        :type mmsi: str
+
+        :param start_time: Start of time range (including), UTC. datetime, 'YYYY-MM-DDTHH:MM:SS' or unix time
+        :param end_time: End of time range (including), UTC. The same types as start_time
+
+        :param bbox: Bounding box (MINLON, MINLAT, MAXLON, MAXLAT)
+        :type bbox: tuple
+
+        :return: list of MT_vessel records
+        """
+        start_time = self.parse_time(start_time)
+        end_time = self.parse_time(end_time)
+
+        conditions = []
+        parameters = []
+        if ship_id is not None:
+            conditions.append('p.ship_id = ?')
+            parameters.append(str(ship_id))
+        if mmsi is not None:
+            conditions.append('p.mmsi = ?')
+            parameters.append(str(mmsi))
+        if start_time is not None:
+            conditions.append('p.t >= ?')
+            parameters.append(start_time)
+        if end_time is not None:
+            conditions.append('p.t <= ?')
+            parameters.append(end_time)
+
+        vessels = []
+        with self.__lock:
+            for day in self.get_days(start_time, end_time):
+                connection = self.__get_partition(day)
+                sql = 'SELECT %s FROM positions p' % ', '.join('p.%s' % column for column in self.columns)
+                partition_conditions = list(conditions)
+                partition_parameters = list(parameters)
+                if bbox is not None:
+                    if self.rtree_available:
+                        sql += ' JOIN positions_rtree r ON r.id = p.id'
+                        partition_conditions.append('r.min_lon <= ? AND r.max_lon >= ? AND r.min_lat <= ? AND r.max_lat >= ?')
+                    else:
+                        partition_conditions.append('p.lon <= ? AND p.lon >= ? AND p.lat <= ? AND p.lat >= ?')
+                    partition_parameters.extend([bbox[2], bbox[0], bbox[3], bbox[1]])
+                if partition_conditions:
+                    sql += ' WHERE %s' % ' AND '.join(partition_conditions)
+                sql += ' ORDER BY p.t'
+
+                for row in connection.execute(sql, partition_parameters):
+                    vessels.append(self.__row_to_vessel(row))
+        return vessels
+
+    def get_days(self, start_time=None, end_time=None):
+        """
+        Days (as 'YYYYMMDD') of existing partitions within time range
+        """
+        pattern = re.compile(r'^%s(\d{8})%s$' % (re.escape(self.partition_prefix), re.escape(self.partition_extension)))
+        start_day = time.strftime('%Y%m%d', time.gmtime(start_time)) if start_time is not None else None
+        end_day = time.strftime('%Y%m%d', time.gmtime(end_time)) if end_time is not None else None
+
+        days = []
+        for file_name in os.listdir(self.directory):
+            match = pattern.match(file_name)
+            if not match:
+                continue
+            day = match.group(1)
+            if (start_day is None or day >= start_day) and (end_day is None or day <= end_day):
+                days.append(day)
+        return sorted(days)
+
+    def close(self):
+        with self.__lock:
+            for connection in self.connections.values():
+                connection.close()
+            self.connections = OrderedDict()
+
+    @staticmethod
+    def parse_time(value):
+        """
+        :return: unix time (int) from datetime, 'YYYY-MM-DDTHH:MM:SS' string (UTC) or number, None for None
+        """
+        if value is None or value == '':
+            return None
+        if isinstance(value, datetime):
+            return calendar.timegm(value.utctimetuple())
+        if isinstance(value, (int, float)):
+            return int(value)
+        return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+    @staticmethod
+    def format_time(value):
+        return None if value is None else time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(value))
+
+    def __get_partition(self, day, create=False):
+        connection = self.connections.pop(day, None)
+        if connection is None:
+            partition_file = os.path.join(self.directory, '%s%s%s' % (self.partition_prefix, day, self.partition_extension))
+            exists = os.path.exists(partition_file)
+            connection = sqlite3.connect(partition_file, check_same_thread=False)
+            if not exists or create:
+                self.__init_partition(connection)
+
+            while len(self.connections) >= self.max_open_partitions:
+                self.connections.popitem(last=False)[1].close()
+        self.connections[day] = connection
+        return connection
+
+    def __init_partition(self, connection):
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS positions (id INTEGER PRIMARY KEY, t INTEGER NOT NULL, '
+                               'ship_id TEXT, mmsi TEXT, imo TEXT, lat REAL NOT NULL, lon REAL NOT NULL, '
+                               'speed INTEGER, heading INTEGER, course INTEGER, status INTEGER, dsrc TEXT, '
+                               'utc_seconds INTEGER, request_time INTEGER)')
+            # One position per vessel and TIMESTAMP
+            connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS positions_position '
+                               'ON positions (ifnull(ship_id, \'\'), ifnull(mmsi, \'\'), t)')
+            connection.execute('CREATE INDEX IF NOT EXISTS positions_ship_id ON positions (ship_id, t)')
+            connection.execute('CREATE INDEX IF NOT EXISTS positions_mmsi ON positions (mmsi, t)')
+            connection.execute('CREATE INDEX IF NOT EXISTS positions_t ON positions (t)')
+
+            try:
+                connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS positions_rtree '
+                                   'USING rtree(id, min_lon, max_lon, min_lat, max_lat)')
+                connection.execute('CREATE TRIGGER IF NOT EXISTS positions_rtree_insert AFTER INSERT ON positions BEGIN '
+                                   'INSERT INTO positions_rtree VALUES (new.id, new.lon, new.lon, new.lat, new.lat); END')
+            except sqlite3.OperationalError:
+                # SQLite without R-tree module, bbox is filtered by plain columns
+                self.rtree_available = False
+
+    def __row_to_vessel(self, row):
+        vessel = MT_vessel()
+        (t, vessel.ship_id, vessel.mmsi, vessel.imo, vessel.lat, vessel.lon, vessel.speed, vessel.heading,
+         vessel.course, vessel.status, dsrc, vessel.utc_seconds, request_time) = row
+        vessel['TIMESTAMP'] = self.format_time(t)
+        vessel['DSRC'] = dsrc
+        vessel['REQUEST_TIME'] = self.format_time(request_time)
+        return vessel
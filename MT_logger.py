@@ -0,0 +1,158 @@
+# coding=utf-8
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # Python 2: records are written by handler directly
+    QueueHandler = None
+    QueueListener = None
+
+
+class MT_json_formatter(logging.Formatter):
+    """
+    Formatter writing every record as one JSON line: time, level, message and extra fields
+    """
+
+    def format(self, record):
+        line = {'time': datetime.utcfromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                'level': record.levelname,
+                'message': record.getMessage()}
+        line.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class MT_rotating_file_handler(RotatingFileHandler):
+    """
+    File handler rotating log both by size (max_bytes) and by time (rotate_interval in minutes)
+    """
+
+    def __init__(self, log_file, max_bytes=0, backup_count=0, rotate_interval=None):
+        RotatingFileHandler.__init__(self, log_file, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.rotate_interval = rotate_interval
+        self.rollover_time = self.__next_rollover_time()
+
+    def shouldRollover(self, record):
+        # Special files (i.e. os.devnull) are never rotated
+        if os.path.exists(self.baseFilename) and not os.path.isfile(self.baseFilename):
+            return 0
+        if self.rollover_time is not None and record.created >= self.rollover_time:
+            return 1
+        return RotatingFileHandler.shouldRollover(self, record)
+
+    def doRollover(self):
+        RotatingFileHandler.doRollover(self)
+        self.rollover_time = self.__next_rollover_time()
+
+    def __next_rollover_time(self):
+        if not self.rotate_interval:
+            return None
+        return time.time() + self.rotate_interval * 60.0
+
+
+class MT_logger():
+    """
+    Leveled structured logger writing JSON lines to rotating file from background thread.
+
+    Messages are put to queue and written by listener thread, so logging does not block polling.
+    Monitors writing to the same file share one logger, but every MT_logger keeps own level.
+    """
+
+    default_max_bytes = 10 * 1024 * 1024
+    default_backup_count = 5
+    default_rotate_interval = 24 * 60  # In minutes
+
+    __loggers = {}
+    __loggers_lock = threading.Lock()
+
+    def __init__(self, log_file, level='INFO', max_bytes=None, backup_count=None, rotate_interval=None):
+        """
+        :param log_file: Path to log file
+        :type log_file: str
+
+        :param level: Minimal level of written messages: 'DEBUG', 'INFO', 'WARNING' or 'ERROR'
+        :type level: str
+
+        :param max_bytes: Size of log file in bytes to rotate it (10 MB by default)
+        :type max_bytes: int
+
+        :param backup_count: Number of kept rotated files (5 by default)
+        :type backup_count: int
+
+        :param rotate_interval: Time in minutes to rotate log file (one day by default)
+        :type rotate_interval: int
+        """
+        self.log_file = os.path.abspath(log_file)
+        self.logger = logging.getLogger('MTMonitor.%s' % self.log_file)
+        self.logger.propagate = False
+        # Shared logger passes all messages, level of every monitor is checked by its MT_logger
+        self.logger.setLevel(logging.DEBUG)
+        self.set_level(level)
+
+        with self.__loggers_lock:
+            if self.log_file in self.__loggers:
+                return
+
+            handler = MT_rotating_file_handler(self.log_file,
+                                               max_bytes=max_bytes if max_bytes is not None else self.default_max_bytes,
+                                               backup_count=backup_count if backup_count is not None else self.default_backup_count,
+                                               rotate_interval=rotate_interval if rotate_interval is not None else self.default_rotate_interval)
+            handler.setFormatter(MT_json_formatter())
+
+            listener = None
+            if QueueHandler is not None:
+                log_queue = Queue(-1)
+                listener = QueueListener(log_queue, handler)
+                listener.start()
+                atexit.register(listener.stop)
+                self.logger.addHandler(QueueHandler(log_queue))
+            else:
+                self.logger.addHandler(handler)
+            self.__loggers[self.log_file] = listener
+
+    def set_level(self, level):
+        """
+        Set minimal level of messages of this logger only, other monitors writing to the same file keep their levels
+        """
+        self.level = getattr(logging, str(level).upper(), logging.INFO)
+
+    def is_debug(self):
+        return self.level <= logging.DEBUG
+
+    def log(self, level, message, **fields):
+        """
+        Write message with given level and extra fields
+
+        :param level: 'debug', 'info', 'warning' or 'error'
+        :type level: str
+        """
+        level_number = getattr(logging, level.upper())
+        if level_number >= self.level:
+            self.logger.log(level_number, '%s', message, extra={'fields': fields})
+
+    def debug(self, message, **fields):
+        self.log('debug', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('info', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('warning', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('error', message, **fields)
@@ -0,0 +1,198 @@
+# coding=utf-8
+
+import json
+import time
+import threading
+
+
+class MT_timer():
+    """
+    Context manager adding duration of block to timer of MT_metrics
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.time() - self.start_time, **self.labels)
+        return False
+
+
+class MT_metrics():
+    """
+    Thread-safe registry of counters, gauges and timers of monitor.
+
+    Counters only grow (i.e. vessels_received), gauges keep last value (i.e. schedule_lag_seconds),
+    timers keep count, sum, max and last of observed durations in seconds (i.e. stage_seconds{stage="filter"}).
+    Every metric may have labels given as keyword arguments.
+
+    Metrics are available as snapshot dict or as Prometheus text format (see MT_metrics_server).
+    """
+
+    prefix = 'mtmonitor_'
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.__lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = self.__get_key(name, labels)
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = self.__get_key(name, labels)
+        with self.__lock:
+            self.gauges[key] = value
+
+    def observe(self, name, duration, **labels):
+        key = self.__get_key(name, labels)
+        with self.__lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'last': 0.0}
+            timer['count'] += 1
+            timer['sum'] += duration
+            timer['max'] = max(timer['max'], duration)
+            timer['last'] = duration
+
+    def timer(self, name, **labels):
+        """
+        :return: context manager measuring duration of its block
+
+        with metrics.timer('stage_seconds', stage='filter'):
+            ...
+        """
+        return MT_timer(self, name, labels)
+
+    def snapshot(self):
+        """
+        :return: dict {'counters': {...}, 'gauges': {...}, 'timers': {...}}, metrics are keyed by
+        name with labels in Prometheus form, i.e. 'stage_seconds{stage="filter"}'
+        """
+        with self.__lock:
+            return {'counters': dict((self.__format_key(key), value) for key, value in self.counters.items()),
+                    'gauges': dict((self.__format_key(key), value) for key, value in self.gauges.items()),
+                    'timers': dict((self.__format_key(key), dict(value)) for key, value in self.timers.items())}
+
+    def render_prometheus(self):
+        """
+        :return: metrics in Prometheus text exposition format. Timers are exposed as summaries
+        (_count and _sum) with additional _max and _last gauges
+        """
+        with self.__lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            timers = sorted((key, dict(value)) for key, value in self.timers.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name, metric_type):
+            if name not in declared:
+                declared.add(name)
+                lines.append('# TYPE %s %s' % (name, metric_type))
+
+        for (name, labels), value in counters:
+            declare(self.prefix + name, 'counter')
+            lines.append('%s%s %s' % (self.prefix + name, self.__format_labels(labels), value))
+        for (name, labels), value in gauges:
+            declare(self.prefix + name, 'gauge')
+            lines.append('%s%s %s' % (self.prefix + name, self.__format_labels(labels), value))
+        for (name, labels), value in timers:
+            declare(self.prefix + name, 'summary')
+            lines.append('%s_count%s %s' % (self.prefix + name, self.__format_labels(labels), value['count']))
+            lines.append('%s_sum%s %s' % (self.prefix + name, self.__format_labels(labels), value['sum']))
+        for (name, labels), value in timers:
+            declare(self.prefix + name + '_max', 'gauge')
+            lines.append('%s_max%s %s' % (self.prefix + name, self.__format_labels(labels), value['max']))
+        for (name, labels), value in timers:
+            declare(self.prefix + name + '_last', 'gauge')
+            lines.append('%s_last%s %s' % (self.prefix + name, self.__format_labels(labels), value['last']))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def __get_key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    @classmethod
+    def __format_key(cls, key):
+        return key[0] + cls.__format_labels(key[1])
+
+    @staticmethod
+    def __format_labels(labels):
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (label, value.replace('\\', '\\\\').replace('"', '\\"'))
+                                 for label, value in labels)
+
+
+class MT_metrics_server():
+    """
+    Local HTTP server exposing metrics on /metrics in Prometheus text format (and on /metrics.json as snapshot)
+    """
+
+    def __init__(self, metrics, port=9108, host='127.0.0.1'):
+        """
+        :param metrics: Metrics to expose
+        :type metrics: MT_metrics
+
+        :param port: Port to listen, 0 for any free port
+        :type port: int
+
+        :param host: Interface to listen, only local by default
+        :type host: str
+        """
+        # HTTP server modules are imported only if metrics are served
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn
+        except ImportError:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn
+
+        self.metrics = metrics
+        metrics_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body = metrics_server.metrics.render_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(metrics_server.metrics.snapshot()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MT metrics server')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
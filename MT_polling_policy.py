@@ -0,0 +1,178 @@
+# coding=utf-8
+
+import time
+
+
+class MT_polling_policy():
+    """
+    Policy defining period between polls of MT_scheduler. Base policy keeps run_period constant.
+
+    Custom policy should subclass it and override next_run_period.
+    """
+
+    def __init__(self, run_period):
+        """
+        :param run_period: How often to poll in minutes
+        :type run_period: float
+        """
+        self.run_period = run_period
+
+    def next_run_period(self, monitor, vessels, poll_time):
+        """
+        Called after every poll
+
+        :param monitor: Monitor performing requests
+        :type monitor: MTMonitor
+
+        :param vessels: Vessels returned by poll, None if poll failed
+        :type vessels: list of MT_vessel
+
+        :param poll_time: Unix time of poll start
+        :type poll_time: float
+
+        :return: period before next poll in minutes
+        """
+        return self.run_period
+
+
+class MT_adaptive_polling_policy(MT_polling_policy):
+    """
+    Policy changing period between polls by observed traffic churn within daily budget of API credits.
+
+    Churn of poll is share of known vessels which are new (NEW), moved farther than min_move degrees
+    or left monitoring areas (were not seen in poll). If churn is above high_churn, period is
+    multiplied by decrease_factor, if below low_churn - by increase_factor. Period stays within
+    [min_run_period, max_run_period].
+
+    If daily_credit_budget is set, period is also not shorter than remaining credits allow until
+    the end of UTC day, assuming cost of poll is credits_per_request * requests + credits_per_vessel * vessels
+    (requests are number of areas in Custom mode, one in Predefined). Budget has priority over max_run_period.
+
+    Every decision is logged with its inputs.
+    """
+
+    default_min_run_period = 1   # In minutes
+    default_max_run_period = 30  # In minutes
+
+    def __init__(self, run_period, min_run_period=None, max_run_period=None, daily_credit_budget=None,
+                 credits_per_request=1, credits_per_vessel=0, low_churn=0.05, high_churn=0.2,
+                 increase_factor=1.5, decrease_factor=0.5, min_move=0.001):
+        """
+        :param run_period: Initial period in minutes
+        :type run_period: float
+
+        :param min_run_period: Shortest period in minutes (1 by default)
+        :type min_run_period: float
+
+        :param max_run_period: Longest period in minutes (30 by default)
+        :type max_run_period: float
+
+        :param daily_credit_budget: API credits allowed per UTC day, unlimited by default
+        :type daily_credit_budget: float
+
+        :param credits_per_request: Credits charged for one API request
+        :type credits_per_request: float
+
+        :param credits_per_vessel: Credits charged for one returned vessel
+        :type credits_per_vessel: float
+
+        :param low_churn: Churn below which period is increased
+        :type low_churn: float
+
+        :param high_churn: Churn above which period is decreased
+        :type high_churn: float
+
+        :param min_move: Position change in degrees counted as move
+        :type min_move: float
+        """
+        MT_polling_policy.__init__(self, run_period)
+        self.min_run_period = min_run_period or self.default_min_run_period
+        self.max_run_period = max_run_period or self.default_max_run_period
+        self.daily_credit_budget = daily_credit_budget
+        self.credits_per_request = credits_per_request
+        self.credits_per_vessel = credits_per_vessel
+        self.low_churn = low_churn
+        self.high_churn = high_churn
+        self.increase_factor = increase_factor
+        self.decrease_factor = decrease_factor
+        self.min_move = min_move
+
+        # Last known positions of vessels as key -> (lon, lat)
+        self.positions = {}
+        self.credits_day = None
+        self.credits_spent = 0
+        self.last_poll_cost = None
+
+    def next_run_period(self, monitor, vessels, poll_time):
+        requests = len(monitor.monitoring_areas) if monitor.mode == 'Custom' else 1
+        poll_cost = self.credits_per_request * requests + self.credits_per_vessel * len(vessels or [])
+        self.__spend_credits(poll_cost, poll_time)
+
+        if vessels is None:
+            monitor.log_message('Polling period kept, poll failed', level='warning', run_period=self.run_period)
+            return self.run_period
+
+        new, moved, exited = self.__count_changes(monitor, vessels, poll_time)
+        churn = float(new + moved + exited) / max(len(self.positions) + exited, 1)
+
+        churn_period = self.run_period
+        if churn > self.high_churn:
+            churn_period = self.run_period * self.decrease_factor
+        elif churn < self.low_churn:
+            churn_period = self.run_period * self.increase_factor
+        churn_period = min(max(churn_period, self.min_run_period), self.max_run_period)
+
+        budget_period = self.__get_budget_period(poll_cost, poll_time)
+        run_period = max(churn_period, budget_period or 0)
+
+        monitor.log_message('Polling period', run_period=round(run_period, 3), previous_run_period=round(self.run_period, 3),
+                            churn=round(churn, 4), new=new, moved=moved, exited=exited, vessels=len(self.positions),
+                            budget_run_period=budget_period and round(budget_period, 3), credits_spent=self.credits_spent,
+                            daily_credit_budget=self.daily_credit_budget)
+        self.run_period = run_period
+        return run_period
+
+    def __count_changes(self, monitor, vessels, poll_time):
+        # Vessel could come several times in one response, it is counted once
+        new_keys = set()
+        moved_keys = set()
+        for vessel in vessels:
+            if vessel.key is None or vessel.lon is None or vessel.lat is None:
+                continue
+            if vessel.new:
+                new_keys.add(vessel.key)
+            previous_position = self.positions.get(vessel.key)
+            if previous_position is not None and (abs(previous_position[0] - vessel.lon) > self.min_move or
+                                                  abs(previous_position[1] - vessel.lat) > self.min_move):
+                moved_keys.add(vessel.key)
+            self.positions[vessel.key] = (vessel.lon, vessel.lat)
+        new = len(new_keys)
+        moved = len(moved_keys - new_keys)
+
+        # Vessels not refreshed in registry by this poll have left areas (it works with deduplicate_positions too)
+        exited_keys = []
+        for key in self.positions:
+            entry = monitor.vessel_registry.get(key)
+            if entry is None or entry['last_seen'] < poll_time:
+                exited_keys.append(key)
+        for key in exited_keys:
+            del self.positions[key]
+        return new, moved, len(exited_keys)
+
+    def __spend_credits(self, credits, poll_time):
+        day = time.strftime('%Y%m%d', time.gmtime(poll_time))
+        if day != self.credits_day:
+            self.credits_day = day
+            self.credits_spent = 0
+        self.credits_spent += credits
+        self.last_poll_cost = credits
+
+    def __get_budget_period(self, poll_cost, poll_time):
+        # Shortest period letting polls like the last one fit into credits left until the end of UTC day
+        if not self.daily_credit_budget or not poll_cost:
+            return None
+        seconds_left = 24 * 3600 - poll_time % (24 * 3600)
+        credits_left = self.daily_credit_budget - self.credits_spent
+        if credits_left < poll_cost:
+            return seconds_left / 60.0
+        return seconds_left / 60.0 / (credits_left // poll_cost)
@@ -0,0 +1,199 @@
+# coding=utf-8
+
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+from MTMonitor import MTMonitor
+from MT_area_index import MT_area_index
+from MT_area_loader import MT_area_loader
+from MT_metrics import MT_metrics
+from MT_scheduler import MT_scheduler
+from MT_transport import MT_transport, MT_request_coalescer
+
+
+class MT_runner():
+    """
+    Runner of many monitors (tenants) with own API keys, areas and sinks in one process.
+
+    All tenants share one HTTP transport (one connection pool per host), monitoring areas loaded from
+    the same source are read, indexed and reloaded once for all tenants using them, and one loop polls
+    every tenant by its own run_period and polling policy. Polls are staggered across the period,
+    so tenants don't send requests at the same moment. Tenants sending identical requests (the same key,
+    mode and time period, and the same areas in Custom mode) are polled together, and request is sent
+    once for all of them (see MT_request_coalescer).
+
+    Every tenant keeps its own sinks, vessel registry, metrics and stats.
+    """
+
+    def __init__(self, transport=None, max_parallel_polls=4, dedupe_window=5, log_file=None):
+        """
+        :param transport: HTTP transport of all tenants, new one by default
+        :type transport: MT_transport
+
+        :param max_parallel_polls: Number of tenants polled at the same time
+        :type max_parallel_polls: int
+
+        :param dedupe_window: Time in seconds to reuse response of identical request
+        :type dedupe_window: float
+
+        :param log_file: Default log file of tenants
+        :type log_file: str
+        """
+        self.transport = transport or MT_transport()
+        self.metrics = MT_metrics()
+        if self.transport.metrics is None:
+            self.transport.metrics = self.metrics
+        self.request_coalescer = MT_request_coalescer(dedupe_window)
+        self.request_coalescer.metrics = self.metrics
+        self.max_parallel_polls = max_parallel_polls
+        self.log_file = log_file
+
+        self.tenants = []
+        self.shared_areas = {}
+        self.stop_event = threading.Event()
+        self.condition = threading.Condition()
+
+    def add_tenant(self, name, MT_API_Key, sinks, mode='Predefined', monitoring_area_source=None, area_simplify_tolerance=None,
+                   area_cache_dir=None, run_period=None, time_period=None, emulation=False, queue_size=1,
+                   overrun_policy='coalesce', polling_policy=None, **monitor_options):
+        """
+        Add monitor to runner. Tenants can't be added while runner is running.
+
+        :param name: Unique name of tenant
+        :type name: str
+
+        :param sinks: Destinations of vessels or function returning them for created monitor, i.e.
+        lambda monitor: [MT_file_sink(monitor, 'vessels.geojson', 'rewrite')]
+        :type sinks: list of MT_sink or function
+
+        :param monitor_options: Other arguments of MTMonitor (log_file, deduplicate_positions etc.)
+
+        Other parameters are the same as for MTMonitor and MTMonitor.automated_vessels_to_sinks
+
+        :return: MTMonitor of tenant
+        """
+        if name in [tenant['name'] for tenant in self.tenants]:
+            raise ValueError('Tenant %s already exists' % name)
+
+        monitor_options.setdefault('log_file', self.log_file)
+        monitor = MTMonitor(MT_API_Key, mode=mode, transport=self.transport, request_coalescer=self.request_coalescer,
+                            reload_areas=False, **monitor_options)
+        if monitoring_area_source:
+            shared_areas = self.__get_shared_areas(monitoring_area_source, area_simplify_tolerance, area_cache_dir)
+            monitor.area_loader = shared_areas['loader']
+            monitor.set_monitoring_areas(shared_areas['areas'], shared_areas['area_index'])
+            shared_areas['monitors'].append(monitor)
+
+        if callable(sinks):
+            sinks = sinks(monitor)
+        scheduler = MT_scheduler(monitor, sinks, run_period, time_period, emulation, queue_size, overrun_policy, polling_policy)
+        # Requests of tenants in the same group are identical, URL includes key, mode, time period and areas bounds
+        group = (MT_API_Key, monitor.mode, time_period or monitor.default_time_period, emulation,
+                 monitoring_area_source if monitor.mode == 'Custom' else None)
+        self.tenants.append({'name': name, 'monitor': monitor, 'scheduler': scheduler, 'group': group,
+                             'next_poll_time': None, 'polling': False, 'polls': 0})
+        return monitor
+
+    def run(self, cycles=None):
+        """
+        Start polling of all tenants. Blocks until stop is called (or every tenant made given number of polls).
+
+        :param cycles: Number of polls of every tenant, infinite by default
+        :type cycles: int
+        """
+        self.stop_event.clear()
+        groups = []
+        for tenant in self.tenants:
+            if tenant['group'] not in groups:
+                groups.append(tenant['group'])
+            tenant['polls'] = 0
+            tenant['scheduler'].start_workers()
+
+        # Group number n of N starts polling with offset of n/N of its run_period
+        start_time = time.time()
+        for tenant in self.tenants:
+            period = tenant['scheduler'].run_period * 60.0
+            tenant['next_poll_time'] = start_time + period * groups.index(tenant['group']) / len(groups)
+
+        pool = ThreadPool(max(1, self.max_parallel_polls))
+        try:
+            with self.condition:
+                while not self.stop_event.is_set():
+                    active_tenants = [tenant for tenant in self.tenants if cycles is None or tenant['polls'] < cycles]
+                    if not active_tenants:
+                        break
+                    now = time.time()
+                    for tenant in active_tenants:
+                        if not tenant['polling'] and tenant['next_poll_time'] <= now:
+                            tenant['polling'] = True
+                            pool.apply_async(self.__poll_tenant, (tenant,))
+                    waiting_times = [tenant['next_poll_time'] for tenant in active_tenants if not tenant['polling']]
+                    # Loop wakes up when poll is finished, on stop or at time of next planned poll
+                    self.condition.wait(max(min(waiting_times) - time.time(), 0) if waiting_times else None)
+        finally:
+            pool.close()
+            pool.join()
+            for tenant in self.tenants:
+                tenant['scheduler'].stop_workers()
+
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+
+    def get_stats(self):
+        """
+        :return: dict with stats of every tenant (see MT_scheduler.get_stats) by name and stats of shared requests
+        """
+        return {'tenants': dict((tenant['name'], tenant['scheduler'].get_stats()) for tenant in self.tenants),
+                'requests': dict(self.request_coalescer.stats)}
+
+    def __poll_tenant(self, tenant):
+        monitor = tenant['monitor']
+        scheduler = tenant['scheduler']
+        try:
+            self.__reload_shared_areas(monitor)
+            poll_time = time.time()
+            monitor.metrics.set_gauge('schedule_lag_seconds', poll_time - tenant['next_poll_time'])
+            vessels = scheduler.poll()
+            next_poll_time = scheduler.plan_next_poll(vessels, poll_time, tenant['next_poll_time'])
+        except Exception as e:
+            # Failure of polling policy or areas reload must not stop other tenants
+            monitor.log_message('Exception while polling tenant! Text: %s' % str(e), level='error')
+            next_poll_time = time.time() + scheduler.run_period * 60.0
+        with self.condition:
+            tenant['next_poll_time'] = next_poll_time
+            tenant['polls'] += 1
+            tenant['polling'] = False
+            self.condition.notify()
+
+    def __get_shared_areas(self, source, simplify_tolerance, cache_dir):
+        key = (source, simplify_tolerance)
+        shared_areas = self.shared_areas.get(key)
+        if shared_areas is None:
+            loader = MT_area_loader(source, simplify_tolerance=simplify_tolerance, cache_dir=cache_dir)
+            areas = loader.load()
+            shared_areas = self.shared_areas[key] = {'loader': loader, 'areas': areas, 'monitors': [],
+                                                     'area_index': MT_area_index([area['geometry'] for area in areas]),
+                                                     'lock': threading.Lock()}
+        return shared_areas
+
+    def __reload_shared_areas(self, monitor):
+        # Areas are reloaded once for all tenants using them, every tenant takes new areas at start of own poll,
+        # so areas are never replaced in the middle of poll
+        for shared_areas in self.shared_areas.values():
+            if monitor not in shared_areas['monitors']:
+                continue
+            with shared_areas['lock']:
+                try:
+                    areas = shared_areas['loader'].reload_if_changed()
+                except Exception as e:
+                    monitor.log_message('Failed to reload monitoring areas! Text: %s' % str(e), level='error')
+                    areas = None
+                if areas is not None:
+                    shared_areas['areas'] = areas
+                    shared_areas['area_index'] = MT_area_index([area['geometry'] for area in areas])
+                    monitor.log_message('Monitoring areas reloaded', areas=len(areas))
+                if monitor.monitoring_areas is not shared_areas['areas']:
+                    monitor.set_monitoring_areas(shared_areas['areas'], shared_areas['area_index'])
+            return
@@ -0,0 +1,246 @@
+# coding=utf-8
+
+import time
+import threading
+from MT_polling_policy import MT_polling_policy
+
+
+class MT_sink_worker():
+    """
+    Background writer of one sink with bounded queue of waiting snapshots.
+
+    If queue is full, new snapshot is either skipped ('skip') or merged with the last waiting one ('coalesce').
+    """
+
+    def __init__(self, sink, logger, queue_size=1, overrun_policy='coalesce', metrics=None):
+        self.sink = sink
+        self.logger = logger
+        self.queue_size = queue_size
+        self.overrun_policy = overrun_policy
+        self.metrics = metrics
+
+        # Waiting snapshots as [vessels, time of the oldest fetch]
+        self.pending = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.stats = {'written': 0, 'skipped': 0, 'coalesced': 0, 'errors': 0,
+                      'last_lag': None, 'max_lag': None, 'last_write_duration': None, 'last_error': None}
+
+        self.thread = threading.Thread(target=self.__run, name='MT sink %s' % sink.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, vessels, fetch_time):
+        with self.condition:
+            if len(self.pending) < self.queue_size:
+                self.pending.append([vessels, fetch_time])
+            elif self.overrun_policy == 'coalesce':
+                self.pending[-1][0] = self.sink.coalesce(self.pending[-1][0], vessels)
+                self.stats['coalesced'] += 1
+                if self.metrics is not None:
+                    self.metrics.increment('sink_coalesced', sink=self.sink.name)
+            else:
+                self.stats['skipped'] += 1
+                if self.metrics is not None:
+                    self.metrics.increment('sink_skipped', sink=self.sink.name)
+                self.logger.warning('Sink is late, snapshot skipped', sink=self.sink.name)
+                return
+            self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+            # Current lag is age of the oldest snapshot not written yet
+            stats['current_lag'] = time.time() - self.pending[0][1] if self.pending else 0
+        return stats
+
+    def stop(self, timeout=None):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                vessels, fetch_time = self.pending.pop(0)
+
+            write_start = time.time()
+            try:
+                self.sink.write(vessels)
+                self.stats['written'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                self.logger.error('Exception while writing to sink! Text: %s' % str(e), sink=self.sink.name)
+                if self.metrics is not None:
+                    self.metrics.increment('sink_errors', sink=self.sink.name)
+
+            lag = time.time() - fetch_time
+            self.stats['last_write_duration'] = time.time() - write_start
+            self.stats['last_lag'] = lag
+            self.stats['max_lag'] = max(lag, self.stats['max_lag'] or 0)
+            if self.metrics is not None:
+                self.metrics.observe('sink_write_seconds', self.stats['last_write_duration'], sink=self.sink.name)
+                self.metrics.set_gauge('sink_lag_seconds', lag, sink=self.sink.name)
+            self.logger.info('Sink written', sink=self.sink.name, vessels=len(vessels), lag=round(lag, 3))
+
+
+class MT_scheduler():
+    """
+    Scheduler polling MarineTraffic once per run_period and passing result to any number of sinks.
+
+    Every sink is written by its own background worker, so slow sink delays neither polling nor other sinks.
+    Sink that can't keep up gets bounded queue (queue_size snapshots). When it is full, new snapshot
+    is skipped ('skip') or merged with waiting one ('coalesce', default): sinks keeping only current
+    state get the newest snapshot, sinks accumulating history get vessels of all polls.
+    If poll itself takes longer than run_period, missed cycles are skipped, not run one after another.
+
+    Period between polls is defined by polling_policy (MT_polling_policy keeps run_period constant,
+    MT_adaptive_polling_policy changes it by traffic churn and API credit budget).
+    """
+
+    def __init__(self, monitor, sinks, run_period=None, time_period=None, emulation=False, queue_size=1, overrun_policy='coalesce',
+                 polling_policy=None):
+        """
+        :param monitor: Monitor performing requests
+        :type monitor: MTMonitor
+
+        :param sinks: Destinations of vessels
+        :type sinks: list of MT_sink
+
+        :param run_period: How often to poll in minutes
+        :type run_period: float
+
+        :param time_period: Time to observe vessels in minutes
+        :type time_period: int
+
+        :param emulation: Emulate vessels instead of API requests
+        :type emulation: bool
+
+        :param queue_size: Number of snapshots waiting for every sink
+        :type queue_size: int
+
+        :param overrun_policy: 'coalesce' or 'skip'
+        :type overrun_policy: str
+
+        :param polling_policy: Policy of period between polls, constant run_period by default
+        :type polling_policy: MT_polling_policy
+        """
+        if overrun_policy not in ['coalesce', 'skip']:
+            raise ValueError('Unsupported overrun policy: %s' % overrun_policy)
+        self.monitor = monitor
+        self.sinks = sinks
+        self.run_period = run_period or monitor.default_run_period
+        self.time_period = time_period
+        self.emulation = emulation
+        self.queue_size = queue_size
+        self.overrun_policy = overrun_policy
+        self.polling_policy = polling_policy or MT_polling_policy(self.run_period)
+
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.stats = {'cycles': 0, 'skipped_cycles': 0, 'errors': 0, 'last_poll_duration': None, 'last_error': None,
+                      'run_period': self.run_period}
+
+    def run(self, cycles=None):
+        """
+        Start polling. Blocks until stop is called (or given number of cycles is done).
+
+        :param cycles: Number of polls to perform, infinite by default
+        :type cycles: int
+        """
+        self.stop_event.clear()
+        self.start_workers()
+        polls = 0
+        # Next poll is planned from start of previous one, so duration of poll doesn't shift the schedule
+        next_poll_time = time.time()
+
+        try:
+            while not self.stop_event.is_set():
+                poll_time = time.time()
+                self.monitor.metrics.set_gauge('schedule_lag_seconds', poll_time - next_poll_time)
+                vessels = self.poll()
+                polls += 1
+                if cycles is not None and polls >= cycles:
+                    break
+
+                next_poll_time = self.plan_next_poll(vessels, poll_time, next_poll_time)
+                self.stop_event.wait(max(next_poll_time - time.time(), 0))
+        finally:
+            self.stop_workers()
+
+    def start_workers(self):
+        """
+        Start background writers of sinks. Called by run, or by outer loop calling poll itself (see MT_runner)
+        """
+        self.workers = [MT_sink_worker(sink, self.monitor.logger, self.queue_size, self.overrun_policy, self.monitor.metrics)
+                        for sink in self.sinks]
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def plan_next_poll(self, vessels, poll_time, next_poll_time):
+        """
+        Time of next poll by polling policy. If it has already passed, missed cycles are skipped
+
+        :param vessels: Vessels of last poll (None if it failed)
+        :param poll_time: Unix time of last poll start
+        :param next_poll_time: Unix time last poll was planned for
+
+        :return: Unix time of next poll
+        """
+        run_period = self.polling_policy.next_run_period(self.monitor, vessels, poll_time)
+        self.stats['run_period'] = run_period
+        period = run_period * 60.0
+        next_poll_time += period
+        now = time.time()
+        if now > next_poll_time:
+            skipped_cycles = int((now - next_poll_time) // period) + 1
+            next_poll_time += skipped_cycles * period
+            self.stats['skipped_cycles'] += skipped_cycles
+            self.monitor.metrics.increment('skipped_cycles', skipped_cycles)
+            self.monitor.log_message('Poll took longer than run_period, cycles skipped', level='warning',
+                                     skipped=skipped_cycles)
+        return next_poll_time
+
+    def poll(self):
+        """
+        Perform one request and pass vessels to all sinks
+
+        :return: vessels or None if request failed
+        """
+        fetch_time = time.time()
+        self.stats['cycles'] += 1
+        self.monitor.log_message('Performing request...')
+        try:
+            vessels = self.monitor.get_vessels(time_period=self.time_period, emulation=self.emulation)
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.stats['last_error'] = str(e)
+            self.monitor.metrics.increment('poll_errors')
+            self.monitor.log_message('Exception while performing request! Text: %s' % str(e), level='error')
+            return None
+        finally:
+            self.stats['last_poll_duration'] = time.time() - fetch_time
+
+        for worker in self.workers:
+            worker.submit(vessels, fetch_time)
+        return vessels
+
+    def stop(self):
+        self.stop_event.set()
+
+    def get_stats(self):
+        """
+        :return: dict with poll stats and stats of every sink (written, skipped, coalesced, errors, lags) by sink name
+        """
+        stats = dict(self.stats)
+        stats['sinks'] = dict((worker.sink.name, worker.get_stats()) for worker in self.workers)
+        return stats
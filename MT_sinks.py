@@ -0,0 +1,493 @@
+# coding=utf-8
+
+import os
+import time
+import gzip
+import threading
+import json
+import shutil
+from datetime import datetime
+from MT_history import MT_history_store
+from MT_geofence import MT_geofence_engine, MT_callback_event_sink
+from MT_vessel import MT_vessel
+
+
+class MT_sink():
+    """
+    Base class of destination for vessels received by MT_scheduler.
+
+    Subclass must implement write(vessels). If sink can't keep up and several snapshots
+    are waiting, they are merged with coalesce: by default only the newest snapshot is kept,
+    sinks accumulating history (append modes) join them.
+    """
+
+    name = 'sink'
+    accumulating = False
+
+    def write(self, vessels):
+        """
+        :param vessels: Vessels of one poll (or several coalesced polls)
+        :type vessels: list of MT_vessel
+        """
+        raise NotImplementedError
+
+    def coalesce(self, pending_vessels, new_vessels):
+        """
+        Merge waiting snapshot with newer one
+
+        :return: list of vessels to write instead of both snapshots
+        """
+        if self.accumulating:
+            return pending_vessels + new_vessels
+        return new_vessels
+
+
+class MT_file_sink(MT_sink):
+    """
+    Sink writing vessels to vector file through MTMonitor.export_vessels_to_file.
+    Write modes are the same as in MTMonitor.automated_vessels_to_file: new, rewrite, append.
+    """
+
+    def __init__(self, monitor, output_file, write_mode='new', output_type='GeoJSON', output_crs='epsg:4326', name=None):
+        """
+        :param monitor: Monitor, which export method is used
+        :type monitor: MTMonitor
+
+        :param output_file: Output file(s) path
+        :type output_file: str
+
+        :param write_mode: 'new', 'rewrite' or 'append'
+        :type write_mode: str
+
+        :param output_type: Output file(s) type
+        :type output_type: str
+
+        :param output_crs: CRS of output file(s) as 'epsg:XXXX'
+        :type output_crs: str
+
+        :param name: Name of sink in stats and log (output_file by default)
+        :type name: str
+        """
+        if write_mode not in ['new', 'rewrite', 'append']:
+            raise ValueError('Unsupported mode: %s' % write_mode)
+        self.monitor = monitor
+        self.output_file = output_file
+        self.write_mode = write_mode
+        self.output_type = output_type
+        self.output_crs = output_crs
+        self.name = name or 'file:%s' % output_file
+        self.accumulating = write_mode in ['new', 'append']
+
+    def write(self, vessels):
+        output_file = self.output_file
+        if self.write_mode == 'new':
+            now = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+            # Only the last extension is split off, so dots in directories and file names are kept
+            output_root, output_extension = os.path.splitext(self.output_file)
+            output_file = '%s_%s%s' % (output_root, now, output_extension)
+
+        self.monitor.export_vessels_to_file(output_file, output_type=self.output_type, write_mode=self.write_mode,
+                                            output_crs=self.output_crs, vessels=vessels)
+
+
+class MT_NGW_sink(MT_sink):
+    """
+    Sink writing vessels to NextGIS Web resource through MTMonitor.export_vessels_to_web.
+    Write modes are the same as in MTMonitor.export_vessels_to_web: rewrite, append, sync.
+    """
+
+    def __init__(self, monitor, nextgis_web_api_options, write_mode='rewrite', chunk_size=None, parallel_chunks=None, name=None):
+        """
+        :param monitor: Monitor, which export method is used
+        :type monitor: MTMonitor
+
+        :param nextgis_web_api_options: All necessary API options
+        :type nextgis_web_api_options: dict
+
+        :param write_mode: 'rewrite', 'append' or 'sync'
+        :type write_mode: str
+
+        :param chunk_size: Number of vessels in one request
+        :type chunk_size: int
+
+        :param parallel_chunks: Number of requests performed at once
+        :type parallel_chunks: int
+
+        :param name: Name of sink in stats and log (resource url by default)
+        :type name: str
+        """
+        if write_mode not in ['rewrite', 'append', 'sync']:
+            raise ValueError('Unsupported mode: %s' % write_mode)
+        self.monitor = monitor
+        self.nextgis_web_api_options = nextgis_web_api_options
+        self.write_mode = write_mode
+        self.chunk_size = chunk_size
+        self.parallel_chunks = parallel_chunks
+        self.name = name or 'ngw:%s/resource/%s' % (nextgis_web_api_options['url'].rstrip('/'),
+                                                    nextgis_web_api_options['resource_id'])
+        self.accumulating = write_mode == 'append'
+
+    def write(self, vessels):
+        failed_chunks = self.monitor.export_vessels_to_web(self.nextgis_web_api_options, self.write_mode,
+                                                           chunk_size=self.chunk_size, parallel_chunks=self.parallel_chunks,
+                                                           vessels=vessels)
+        if failed_chunks:
+            raise Exception('%s chunks were not written to NGW' % len(failed_chunks))
+
+
+class MT_history_sink(MT_sink):
+    """
+    Sink adding vessels to positions history (MT_history_store), partitioned by day
+    """
+
+    accumulating = True
+
+    def __init__(self, history_store, name=None):
+        """
+        :param history_store: History store or path to its directory
+        :type history_store: MT_history_store or str
+        """
+        if not isinstance(history_store, MT_history_store):
+            history_store = MT_history_store(history_store)
+        self.history_store = history_store
+        self.name = name or 'history:%s' % history_store.directory
+
+    def write(self, vessels):
+        self.history_store.write(vessels)
+
+
+class MT_track_sink(MT_sink):
+    """
+    Sink adding vessels to tracks (MT_track_builder) and exporting tracks to file and/or NextGIS Web.
+
+    NGW export in sync mode sends only changed tracks after every update. File holds all tracks and
+    is rewritten completely, so it is written not more often than once per file_export_period
+    and on demand with export_file.
+    """
+
+    accumulating = True
+    default_file_export_period = 60  # In minutes
+
+    def __init__(self, monitor, track_builder, output_file=None, output_type='GeoJSON', output_crs='epsg:4326',
+                 nextgis_web_api_options=None, ngw_write_mode='sync', name=None, file_export_period=None):
+        """
+        :param monitor: Monitor, which export methods are used
+        :type monitor: MTMonitor
+
+        :param track_builder: Builder of tracks
+        :type track_builder: MT_track_builder
+
+        :param output_file: File rewritten with all tracks, no file export by default
+        :type output_file: str
+
+        :param file_export_period: Minimal time in minutes between rewrites of output_file (60 by default),
+        0 to rewrite it after every update
+        :type file_export_period: float
+
+        :param nextgis_web_api_options: NGW resource for tracks, no NGW export by default
+        :type nextgis_web_api_options: dict
+
+        :param ngw_write_mode: 'sync' or 'rewrite'
+        :type ngw_write_mode: str
+        """
+        self.monitor = monitor
+        self.track_builder = track_builder
+        self.output_file = output_file
+        self.output_type = output_type
+        self.output_crs = output_crs
+        self.nextgis_web_api_options = nextgis_web_api_options
+        self.ngw_write_mode = ngw_write_mode
+        self.file_export_period = file_export_period if file_export_period is not None else self.default_file_export_period
+        self.last_file_export_time = None
+        # export_file could be called from other thread while sink worker updates tracks
+        self.lock = threading.RLock()
+        self.name = name or 'tracks:%s' % (output_file or nextgis_web_api_options and nextgis_web_api_options['url'])
+
+    def write(self, vessels):
+        with self.lock:
+            self.track_builder.update(vessels)
+            if self.output_file and (self.last_file_export_time is None or
+                                     time.time() - self.last_file_export_time >= self.file_export_period * 60.0):
+                self.export_file()
+            if self.nextgis_web_api_options:
+                failed_chunks = self.monitor.export_tracks_to_web(self.track_builder, self.nextgis_web_api_options,
+                                                                  write_mode=self.ngw_write_mode)
+                if failed_chunks:
+                    raise Exception('%s chunks of tracks were not written to NGW' % len(failed_chunks))
+
+    def export_file(self):
+        """
+        Rewrite output_file with current tracks
+        """
+        with self.lock:
+            self.monitor.export_tracks_to_file(self.track_builder, self.output_file, output_type=self.output_type,
+                                               output_crs=self.output_crs)
+            self.last_file_export_time = time.time()
+
+
+class MT_geofence_sink(MT_sink):
+    """
+    Sink turning vessels into enter, exit and dwell events of monitoring areas (MT_geofence_engine)
+    and passing only events to event sinks
+    """
+
+    accumulating = True
+
+    def __init__(self, monitor, event_sinks, geofence_engine=None, name=None):
+        """
+        :param monitor: Monitor, which monitoring areas are used
+        :type monitor: MTMonitor
+
+        :param event_sinks: Destinations of events (MT_event_sink or functions taking list of events)
+        :type event_sinks: list
+
+        :param geofence_engine: Engine keeping state of vessels in areas, new one without dwell events by default
+        :type geofence_engine: MT_geofence_engine
+        """
+        self.monitor = monitor
+        self.event_sinks = [event_sink if hasattr(event_sink, 'write_events') else MT_callback_event_sink(event_sink)
+                            for event_sink in event_sinks]
+        self.geofence_engine = geofence_engine if geofence_engine is not None else MT_geofence_engine()
+        self.name = name or 'geofence:%s' % ','.join(event_sink.name for event_sink in self.event_sinks)
+
+    def write(self, vessels):
+        # Areas could be reloaded by poll thread, so list and index are taken together
+        areas, area_index = self.monitor.monitoring_areas_with_index
+        events = self.geofence_engine.update(vessels, areas, area_index)
+        if not events:
+            return
+        for event in events:
+            self.monitor.metrics.increment('geofence_events', event=event['event'])
+        for event_sink in self.event_sinks:
+            event_sink.write_events(events)
+
+
+class MT_rotating_file_sink(MT_sink):
+    """
+    Sink appending vessels to GeoJSONSeq segments (one GeoJSON feature per line, EPSG:4326),
+    rolled by time window ('hourly' or 'daily', UTC) and optionally by size.
+
+    Active segment is written uncompressed, closed segments are compressed with gzip (.geojsonl.gz).
+    Segments are listed in manifest <prefix>_manifest.json in output directory with time ranges of positions
+    (TIMESTAMP), numbers of vessels and polls, so readers find segments by time without listing directory
+    (see find_segments). Every sink writes only manifest of own prefix, so sinks with different prefixes
+    could share directory. Manifest is rewritten only when segment is opened or closed. Until active segment
+    is closed, its start_time, end_time, vessels, polls and size are None in manifest, so it matches any time range.
+    Active segment left by previous run is continued, its counters are recounted from its file.
+    As other sinks, it is written by background worker of MT_scheduler, so polling doesn't wait for it.
+    """
+
+    accumulating = True
+    windows = {'hourly': '%Y%m%dT%H', 'daily': '%Y%m%d'}
+    manifest_suffix = '_manifest.json'
+    segment_extension = '.geojsonl'
+
+    def __init__(self, output_dir, prefix='vessels', rotation='hourly', max_segment_size=None, compress=True, name=None):
+        """
+        :param output_dir: Directory of segments and manifest
+        :type output_dir: str
+
+        :param prefix: Prefix of segment file names, i.e. vessels_20180402T18.geojsonl.gz
+        :type prefix: str
+
+        :param rotation: 'hourly' or 'daily'
+        :type rotation: str
+
+        :param max_segment_size: Size in bytes after which segment is closed before end of window, unlimited by default
+        :type max_segment_size: int
+
+        :param compress: Compress closed segments with gzip
+        :type compress: bool
+        """
+        if rotation not in self.windows:
+            raise ValueError('Unsupported rotation: %s' % rotation)
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.rotation = rotation
+        self.max_segment_size = max_segment_size
+        self.compress = compress
+        self.name = name or 'segments:%s' % os.path.join(output_dir, prefix)
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        # Segments of previous runs are kept, active segment of the same window is continued
+        self.segments = self.read_manifest(output_dir, prefix)
+        self.manifest_changed = False
+        if self.segments and not self.segments[-1]['closed']:
+            self.__recount_segment(self.segments[-1])
+
+    def write(self, vessels):
+        vessels = [vessel for vessel in MT_vessel.from_records(vessels) if vessel.lat is not None and vessel.lon is not None]
+        if not vessels:
+            return
+
+        segment = self.__get_active_segment(datetime.utcnow().strftime(self.windows[self.rotation]))
+        segment_file = os.path.join(self.output_dir, segment['file'])
+        with open(segment_file, 'a') as output:
+            output.writelines(json.dumps(self.__describe_feature(vessel)) + '\n' for vessel in vessels)
+
+        timestamps = [vessel.timestamp for vessel in vessels if vessel.timestamp]
+        if timestamps:
+            segment['start_time'] = min(timestamps + ([segment['start_time']] if segment['start_time'] else []))
+            segment['end_time'] = max(timestamps + ([segment['end_time']] if segment['end_time'] else []))
+        segment['vessels'] += len(vessels)
+        segment['polls'] += 1
+        segment['size'] = os.path.getsize(segment_file)
+        if self.max_segment_size and segment['size'] >= self.max_segment_size:
+            self.__close_segment(segment)
+        if self.manifest_changed:
+            self.__write_manifest()
+
+    def close(self):
+        """
+        Close active segment, i.e. before stopping. Next write starts new segment
+        """
+        if self.segments and not self.segments[-1]['closed']:
+            self.__close_segment(self.segments[-1])
+            self.__write_manifest()
+
+    @classmethod
+    def read_manifest(cls, output_dir, prefix=None):
+        """
+        :param prefix: Prefix of segments, segments of all prefixes by default
+        :type prefix: str
+
+        :return: list of segments as dicts with file, prefix, window, start_time, end_time, vessels, polls, size, closed
+        """
+        if prefix is not None:
+            manifest_files = [cls.get_manifest_file(output_dir, prefix)]
+        elif os.path.isdir(output_dir):
+            manifest_files = [os.path.join(output_dir, file_name) for file_name in sorted(os.listdir(output_dir))
+                              if file_name.endswith(cls.manifest_suffix)]
+        else:
+            manifest_files = []
+
+        segments = []
+        for manifest_file in manifest_files:
+            if os.path.exists(manifest_file):
+                with open(manifest_file) as fl:
+                    segments.extend(json.load(fl)['segments'])
+        return segments
+
+    @classmethod
+    def get_manifest_file(cls, output_dir, prefix):
+        return os.path.join(output_dir, prefix + cls.manifest_suffix)
+
+    @classmethod
+    def find_segments(cls, output_dir, start_time=None, end_time=None, prefix=None):
+        """
+        Segments with positions within time range, found by manifest
+
+        :param start_time: Start of range as 'YYYY-MM-DDTHH:MM:SS' (UTC), unlimited by default
+        :type start_time: str
+
+        :param end_time: End of range as 'YYYY-MM-DDTHH:MM:SS' (UTC), unlimited by default
+        :type end_time: str
+
+        :param prefix: Prefix of segments, all segments by default
+        :type prefix: str
+
+        :return: list of segments (see read_manifest) with full path of file in 'path'
+        """
+        segments = []
+        for segment in cls.read_manifest(output_dir, prefix):
+            if start_time is not None and segment['end_time'] is not None and segment['end_time'] < start_time:
+                continue
+            if end_time is not None and segment['start_time'] is not None and segment['start_time'] > end_time:
+                continue
+            segments.append(dict(segment, path=os.path.join(output_dir, segment['file'])))
+        return segments
+
+    @staticmethod
+    def iter_features(segment_path):
+        """
+        :return: generator of GeoJSON features of segment (compressed or not)
+        """
+        opener = gzip.open if segment_path.endswith('.gz') else open
+        with opener(segment_path, 'rb') as fl:
+            for line in fl:
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+
+    def __get_active_segment(self, window):
+        segment = self.segments[-1] if self.segments and not self.segments[-1]['closed'] else None
+        if segment is not None and segment['window'] != window:
+            self.__close_segment(segment)
+            segment = None
+        if segment is None:
+            # Segments of the same window (closed by size) are numbered
+            number = len([segment for segment in self.segments if segment['window'] == window])
+            segment = {'file': '%s_%s%s%s' % (self.prefix, window, '_%s' % number if number else '', self.segment_extension),
+                       'prefix': self.prefix,
+                       'window': window,
+                       'start_time': None,
+                       'end_time': None,
+                       'vessels': 0,
+                       'polls': 0,
+                       'size': 0,
+                       'closed': False}
+            self.segments.append(segment)
+            self.manifest_changed = True
+        return segment
+
+    def __close_segment(self, segment):
+        segment_file = os.path.join(self.output_dir, segment['file'])
+        if self.compress and os.path.exists(segment_file):
+            # Compressed file appears under its name only when it is complete
+            compressed_file = segment_file + '.gz'
+            with open(segment_file, 'rb') as input:
+                with gzip.open(compressed_file + '.tmp', 'wb') as output:
+                    shutil.copyfileobj(input, output)
+            self.__replace_file(compressed_file + '.tmp', compressed_file)
+            os.remove(segment_file)
+            segment['file'] += '.gz'
+            segment['size'] = os.path.getsize(compressed_file)
+        segment['closed'] = True
+        self.manifest_changed = True
+
+    def __recount_segment(self, segment):
+        # Manifest has no counters of active segment, they are taken from features written to it
+        segment.update({'start_time': None, 'end_time': None, 'vessels': 0, 'polls': 0, 'size': 0})
+        segment_file = os.path.join(self.output_dir, segment['file'])
+        if not os.path.exists(segment_file):
+            return
+        request_times = set()
+        for feature in self.iter_features(segment_file):
+            properties = feature.get('properties') or {}
+            timestamp = properties.get('TIMESTAMP')
+            if timestamp:
+                segment['start_time'] = min(timestamp, segment['start_time'] or timestamp)
+                segment['end_time'] = max(timestamp, segment['end_time'] or timestamp)
+            request_times.add(properties.get('REQUEST_TIME'))
+            segment['vessels'] += 1
+        # Vessels of one poll share REQUEST_TIME
+        segment['polls'] = len(request_times)
+        segment['size'] = os.path.getsize(segment_file)
+
+    def __write_manifest(self):
+        manifest_file = self.get_manifest_file(self.output_dir, self.prefix)
+        temp_file = '%s.%s.tmp' % (manifest_file, os.getpid())
+        # Active segment is still growing, so it is listed as open-ended
+        segments = [segment if segment['closed'] else
+                    dict(segment, start_time=None, end_time=None, vessels=None, polls=None, size=None)
+                    for segment in self.segments]
+        with open(temp_file, 'w') as fl:
+            json.dump({'segments': segments}, fl, indent=1)
+        self.__replace_file(temp_file, manifest_file)
+        self.manifest_changed = False
+
+    @staticmethod
+    def __replace_file(source_file, dest_file):
+        # Readers never see missing or half-written file
+        if hasattr(os, 'replace'):
+            os.replace(source_file, dest_file)
+        else:
+            if os.path.exists(dest_file):
+                os.remove(dest_file)
+            os.rename(source_file, dest_file)
+
+    @staticmethod
+    def __describe_feature(vessel):
+        return {'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [vessel.lon, vessel.lat]},
+                'properties': vessel.as_dict()}
@@ -0,0 +1,122 @@
+# coding=utf-8
+
+import csv
+import json
+import codecs
+
+
+class MT_stream_parser():
+    """
+    Incremental parsers of MarineTraffic responses.
+
+    Response body is read by chunks and vessels are yielded one by one as dicts,
+    so whole body and whole list of vessels are never kept in memory at once.
+    Supported protocols are jsono (JSON array of objects) and csv (header line and rows).
+    """
+
+    chunk_size = 64 * 1024
+
+    @classmethod
+    def iter_response(cls, response, protocol='jsono'):
+        """
+        Yield vessels from streamed response (requested with stream=True)
+
+        :param response: Response of MarineTraffic API
+        :type response: requests.Response
+
+        :param protocol: 'jsono' or 'csv'
+        :type protocol: str
+
+        :return: generator of vessels as dicts
+        """
+        try:
+            if protocol == 'csv':
+                lines = (line.decode('utf-8') if isinstance(line, bytes) else line for line in response.iter_lines())
+                for record in cls.iter_csv_records(lines):
+                    yield record
+            else:
+                for record in cls.iter_json_objects(cls.__iter_text(response.iter_content(cls.chunk_size))):
+                    yield record
+        finally:
+            response.close()
+
+    @staticmethod
+    def iter_json_objects(text_chunks):
+        """
+        Yield objects of JSON array, received as sequence of text chunks
+
+        If response is JSON object instead of array (MarineTraffic returns errors this way),
+        exception with its content is raised.
+
+        :param text_chunks: Iterable of str
+        :return: generator of dicts
+        """
+        decoder = json.JSONDecoder()
+        chunks = iter(text_chunks)
+        buffer = ''
+        position = 0
+        array_started = False
+        stream_ended = False
+
+        while True:
+            # Skipping whitespaces and separators between objects
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+
+            if position < len(buffer):
+                if not array_started:
+                    if buffer[position] == '[':
+                        array_started = True
+                        position += 1
+                        continue
+                    if buffer[position] != '{':
+                        raise ValueError('Unexpected response: %s' % buffer[position:position + 500])
+                elif buffer[position] == ']':
+                    return
+
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # Object is not complete yet, reading more
+                    if stream_ended:
+                        raise
+                else:
+                    if not array_started:
+                        raise ValueError('Unexpected response: %s' % json.dumps(item)[:500])
+                    position = end
+                    yield item
+                    continue
+            elif stream_ended:
+                if array_started:
+                    raise ValueError('Unexpected end of response')
+                return
+
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                stream_ended = True
+                continue
+            buffer = buffer[position:] + chunk
+            position = 0
+
+    @staticmethod
+    def iter_csv_records(lines):
+        """
+        Yield rows of CSV with header line as dicts
+
+        :param lines: Iterable of str lines
+        :return: generator of dicts
+        """
+        for row in csv.DictReader(line for line in lines if line):
+            yield row
+
+    @staticmethod
+    def __iter_text(byte_chunks):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for byte_chunk in byte_chunks:
+            text = decoder.decode(byte_chunk)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
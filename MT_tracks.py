@@ -0,0 +1,190 @@
+# coding=utf-8
+
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from shapely.geometry import LineString
+from MT_vessel import MT_vessel
+
+
+class MT_track():
+    """
+    Track of one vessel: positions ordered by TIMESTAMP.
+
+    If max_points is set, positions are kept in bounded deques, so the oldest position is dropped
+    in constant time when new one is added to full track.
+    """
+
+    __slots__ = ('key', 'ship_id', 'mmsi', 'times', 'lons', 'lats', 'ngw_ids')
+
+    def __init__(self, key, ship_id=None, mmsi=None, max_points=None):
+        self.key = key
+        self.ship_id = ship_id
+        self.mmsi = mmsi
+        self.times = deque(maxlen=max_points)
+        self.lons = deque(maxlen=max_points)
+        self.lats = deque(maxlen=max_points)
+        # NGW feature id of track by (url, resource_id), used by sync export
+        self.ngw_ids = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, timestamp, lon, lat):
+        """
+        Add position to track. Position with already known TIMESTAMP is ignored.
+
+        :return: True if position was added
+        """
+        # Positions almost always come in order of time, so new one is just appended (full deque drops the oldest)
+        if not self.times or timestamp > self.times[-1]:
+            self.times.append(timestamp)
+            self.lons.append(lon)
+            self.lats.append(lat)
+            return True
+
+        index = bisect_left(self.times, timestamp)
+        if index < len(self.times) and self.times[index] == timestamp:
+            return False
+        if len(self.times) == self.times.maxlen:
+            # Full track keeps only newer positions, the oldest one is dropped to make place for late position
+            if index == 0:
+                return False
+            self.times.popleft()
+            self.lons.popleft()
+            self.lats.popleft()
+            index -= 1
+        for values, value in ((self.times, timestamp), (self.lons, lon), (self.lats, lat)):
+            # deque.insert is absent in Python 2
+            values.rotate(-index)
+            values.appendleft(value)
+            values.rotate(index)
+        return True
+
+    def get_coordinates(self, simplify_tolerance=None):
+        """
+        :param simplify_tolerance: Tolerance of Douglas-Peucker simplification in degrees, no simplification by default
+        :type simplify_tolerance: float
+
+        :return: list of (lon, lat)
+        """
+        coordinates = list(zip(self.lons, self.lats))
+        if simplify_tolerance and len(coordinates) > 2:
+            coordinates = list(LineString(coordinates).simplify(simplify_tolerance, preserve_topology=False).coords)
+        return coordinates
+
+
+class MT_track_builder():
+    """
+    Incremental builder of vessel tracks from results of MTMonitor.get_vessels.
+
+    Every new position is added to track of its vessel (by SHIP_ID, MMSI if SHIP_ID is absent).
+    Positions repeated in overlapping requests (the same vessel and TIMESTAMP) are added once.
+    Update costs time proportional to number of new positions, not to length of tracks.
+    Vessels changed since last export are remembered, so exports could send only changed tracks.
+
+    Tracks are exported with MTMonitor.export_tracks_to_file and MTMonitor.export_tracks_to_web.
+    """
+
+    default_ttl = 24 * 60  # In minutes
+
+    def __init__(self, max_points=None, ttl=None, simplify_tolerance=None):
+        """
+        :param max_points: Maximal number of positions kept for vessel (the oldest are dropped), unlimited by default
+        :type max_points: int
+
+        :param ttl: Time in minutes after which track of vessel not seen anymore is dropped (24 hours by default)
+        :type ttl: int
+
+        :param simplify_tolerance: Tolerance of track simplification on export in degrees, no simplification by default
+        :type simplify_tolerance: float
+        """
+        self.max_points = max_points
+        self.ttl = ttl if ttl is not None else self.default_ttl
+        self.simplify_tolerance = simplify_tolerance
+
+        # Tracks are kept in order of last update, so the oldest are always at the beginning
+        self.tracks = OrderedDict()
+        self.last_update = {}
+        self.changed = set()
+        self.removed = {}
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def update(self, vessels, update_time=None):
+        """
+        Add positions of vessels to tracks
+
+        :param vessels: Vessels as returned by MTMonitor.get_vessels
+        :type vessels: list of MT_vessel
+
+        :return: number of added positions
+        """
+        if update_time is None:
+            update_time = time.time()
+
+        added = 0
+        for vessel in MT_vessel.from_records(vessels):
+            key = vessel.key
+            if not key or vessel.lat is None or vessel.lon is None:
+                continue
+            track = self.tracks.pop(key, None)
+            if track is None:
+                track = MT_track(key, vessel.ship_id, vessel.mmsi, self.max_points)
+            self.tracks[key] = track
+            self.last_update[key] = update_time
+
+            if track.add(vessel.timestamp or vessel.request_time or '', vessel.lon, vessel.lat):
+                added += 1
+                self.changed.add(key)
+
+        self.evict(update_time)
+        return added
+
+    def evict(self, current_time=None):
+        """
+        Drop tracks of vessels not seen longer than ttl
+
+        :return: number of dropped tracks
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        expiration_time = current_time - self.ttl * 60.0
+        evicted = 0
+        while self.tracks:
+            key = next(iter(self.tracks))
+            if self.last_update[key] >= expiration_time:
+                break
+            # Dropped tracks are remembered until export, so their features could be deleted too
+            self.removed[key] = self.tracks.pop(key)
+            del self.last_update[key]
+            self.changed.discard(key)
+            evicted += 1
+        return evicted
+
+    def get_track(self, key):
+        return self.tracks.get(key)
+
+    def pop_changes(self):
+        """
+        Tracks changed and dropped since previous call
+
+        :return: tuple (list of changed MT_track, list of dropped MT_track)
+        """
+        changed = [self.tracks[key] for key in self.changed if key in self.tracks]
+        removed = list(self.removed.values())
+        self.changed = set()
+        self.removed = {}
+        return changed, removed
+
+    def describe_track(self, track):
+        """
+        :return: properties of track as dict of strings
+        """
+        return {'SHIP_ID': track.ship_id,
+                'MMSI': track.mmsi,
+                'START_TIME': track.times[0] if track.times else None,
+                'END_TIME': track.times[-1] if track.times else None,
+                'POINTS': str(len(track))}
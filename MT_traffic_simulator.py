@@ -0,0 +1,184 @@
+# coding=utf-8
+
+import math
+import time
+import random
+
+
+class MT_traffic_simulator():
+    """
+    Seeded simulator of vessel traffic for emulation mode and benchmarks.
+
+    Keeps vessels_count distinct vessels moving with constant speed along courses slightly changing
+    over time inside bounds (vessels turn back at the border). Every vessel reports its position
+    once per own report interval, like AIS stations do, and payload contains last reported positions
+    not older than timespan, with the same fields and string values as MarineTraffic PS05/PS06 jsono response.
+
+    The same seed, bounds and sequence of advance calls always give the same payloads.
+    """
+
+    default_bounds = {'x_min': 58.3209, 'x_max': 59.6744, 'y_min': 68.9573, 'y_max': 69.544}  # Dolgiy island
+    default_start_time = 1514764800  # 2018-01-01T00:00:00Z
+    mmsi_prefixes = (273, 304, 209, 636, 538, 257, 351, 477)
+
+    def __init__(self, vessels_count=10, bounds=None, seed=None, start_time=None, time_step=None,
+                 min_report_interval=10, max_report_interval=360):
+        """
+        :param vessels_count: Number of distinct vessels
+        :type vessels_count: int
+
+        :param bounds: Area of traffic as dict with x_min, x_max, y_min, y_max in degrees (Dolgiy island by default)
+        :type bounds: dict
+
+        :param seed: Seed of random generator
+        :type seed: int
+
+        :param start_time: Unix time of simulation start, fixed date by default
+        :type start_time: float
+
+        :param time_step: Simulated seconds per advance call. By default simulation follows real time
+        :type time_step: float
+
+        :param min_report_interval: Shortest interval between position reports of vessel in seconds
+        :type min_report_interval: float
+
+        :param max_report_interval: Longest interval between position reports of vessel in seconds
+        :type max_report_interval: float
+        """
+        self.vessels_count = vessels_count
+        self.bounds = bounds or self.default_bounds
+        self.random = random.Random(seed)
+        self.time = start_time if start_time is not None else self.default_start_time
+        self.time_step = time_step
+        self.last_advance_time = None
+
+        self.__init_vessels(min_report_interval, max_report_interval)
+
+    def advance(self, seconds=None):
+        """
+        Move all vessels forward in time
+
+        :param seconds: Simulated seconds, by default time_step or real time passed since previous call
+        :type seconds: float
+        """
+        now = time.time()
+        if seconds is None:
+            if self.time_step is not None:
+                seconds = self.time_step
+            else:
+                seconds = now - self.last_advance_time if self.last_advance_time is not None else 0
+        self.last_advance_time = now
+        if seconds <= 0:
+            return
+
+        # Long advances are split, so vessels turn at borders and change courses on the way
+        steps = int(math.ceil(seconds / 600.0))
+        for step in range(steps):
+            self.__step(seconds / steps)
+
+    def get_payload(self, timespan=None, bounds=None):
+        """
+        Positions reported within timespan as in MarineTraffic response
+
+        :param timespan: Maximal age of positions in minutes, all last positions by default
+        :type timespan: int
+
+        :param bounds: Area of PS06 request (dict with x_min, x_max, y_min, y_max), whole traffic by default (PS05)
+        :type bounds: dict
+
+        :return: list of dicts with string values
+        """
+        min_report_time = self.time - timespan * 60.0 if timespan else None
+        payload = []
+        for index in range(self.vessels_count):
+            report_time = self.report_times[index]
+            if min_report_time is not None and report_time < min_report_time:
+                continue
+            lon = self.report_lons[index]
+            lat = self.report_lats[index]
+            if bounds is not None and not (bounds['x_min'] <= lon <= bounds['x_max'] and bounds['y_min'] <= lat <= bounds['y_max']):
+                continue
+            payload.append(self.__describe_vessel(index, report_time, lon, lat))
+        return payload
+
+    def __init_vessels(self, min_report_interval, max_report_interval):
+        rnd = self.random
+        self.ship_ids = []
+        self.mmsis = []
+        self.imos = []
+        self.dsrcs = []
+        self.statuses = []
+        self.speeds = []
+        self.courses = []
+        self.lons = []
+        self.lats = []
+        self.report_intervals = []
+        self.report_times = []
+        self.report_lons = []
+        self.report_lats = []
+        self.report_speeds = []
+        self.report_courses = []
+
+        for index in range(self.vessels_count):
+            self.ship_ids.append(str(100000 + index))
+            self.mmsis.append('%d%06d' % (rnd.choice(self.mmsi_prefixes), index % 1000000))
+            self.imos.append(str(9000000 + index) if rnd.random() < 0.7 else '0')
+            self.dsrcs.append('TER' if rnd.random() < 0.8 else 'SAT')
+            # Part of vessels is anchored or moored (STATUS 1 and 5) and doesn't move
+            status = rnd.choice((0, 0, 0, 0, 0, 0, 0, 1, 5, 8))
+            self.statuses.append(status)
+            self.speeds.append(0.0 if status in (1, 5) else rnd.uniform(3, 20))  # In knots
+            self.courses.append(rnd.uniform(0, 360))
+            self.lons.append(rnd.uniform(self.bounds['x_min'], self.bounds['x_max']))
+            self.lats.append(rnd.uniform(self.bounds['y_min'], self.bounds['y_max']))
+            self.report_intervals.append(rnd.uniform(min_report_interval, max_report_interval))
+            # Vessels are already reporting at start of simulation
+            self.report_times.append(self.time - rnd.uniform(0, self.report_intervals[-1]))
+            self.report_lons.append(self.lons[-1])
+            self.report_lats.append(self.lats[-1])
+            self.report_speeds.append(self.speeds[-1])
+            self.report_courses.append(self.courses[-1])
+
+    def __step(self, seconds):
+        rnd = self.random
+        bounds = self.bounds
+        self.time += seconds
+        for index in range(self.vessels_count):
+            speed = self.speeds[index]
+            if speed:
+                course = (self.courses[index] + rnd.gauss(0, 2) * seconds / 60.0) % 360
+                distance = speed * seconds / 3600.0 / 60.0  # In degrees of latitude
+                lat = self.lats[index] + distance * math.cos(math.radians(course))
+                lon = self.lons[index] + distance * math.sin(math.radians(course)) / max(math.cos(math.radians(lat)), 0.01)
+                # Vessel reaching border turns back
+                if not bounds['x_min'] <= lon <= bounds['x_max']:
+                    course = (360 - course) % 360
+                    lon = min(max(lon, bounds['x_min']), bounds['x_max'])
+                if not bounds['y_min'] <= lat <= bounds['y_max']:
+                    course = (180 - course) % 360
+                    lat = min(max(lat, bounds['y_min']), bounds['y_max'])
+                self.courses[index] = course
+                self.lons[index] = lon
+                self.lats[index] = lat
+
+            if self.time - self.report_times[index] >= self.report_intervals[index]:
+                self.report_times[index] = self.time
+                self.report_lons[index] = self.lons[index]
+                self.report_lats[index] = self.lats[index]
+                self.report_speeds[index] = self.speeds[index]
+                self.report_courses[index] = self.courses[index]
+
+    def __describe_vessel(self, index, report_time, lon, lat):
+        course = int(self.report_courses[index]) % 360
+        return {'MMSI': self.mmsis[index],
+                'IMO': self.imos[index],
+                'SHIP_ID': self.ship_ids[index],
+                'LAT': '%.6f' % lat,
+                'LON': '%.6f' % lon,
+                'SPEED': str(int(round(self.report_speeds[index] * 10))),  # In knots x10, as in API
+                'HEADING': str(course if self.report_speeds[index] else 511),
+                'COURSE': str(course),
+                'STATUS': str(self.statuses[index]),
+                'TIMESTAMP': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(report_time)),
+                'DSRC': self.dsrcs[index],
+                'UTC_SECONDS': str(int(report_time) % 60)}
@@ -0,0 +1,103 @@
+# coding=utf-8
+
+import threading
+
+
+class MT_transform():
+    """
+    Coordinate transformation with cache of transformers.
+
+    Transformer for every (source, destination) pair of CRS is created once per process
+    and is reused by area loader, NGW and file exporters. Coordinates are transformed
+    as whole arrays in one call. CRS are given as 'epsg:XXXX' strings, axis order is always x, y (lon, lat).
+
+    pyproj is imported on first transformation, so importing this module is cheap.
+    """
+
+    __transformers = {}
+    __transformers_lock = threading.Lock()
+    __pyproj = None
+
+    @classmethod
+    def get_pyproj(cls):
+        """
+        :return: dict with pyproj 'Transformer' (None for pyproj < 2.1, then 'Proj' and 'transform' are set)
+        """
+        if cls.__pyproj is None:
+            try:
+                from pyproj import Transformer
+                cls.__pyproj = {'Transformer': Transformer}
+            except ImportError:
+                # pyproj < 2.1
+                from pyproj import Proj, transform
+                cls.__pyproj = {'Transformer': None, 'Proj': Proj, 'transform': transform}
+        return cls.__pyproj
+
+    @classmethod
+    def get_transformer(cls, source_crs, dest_crs):
+        """
+        Cached transformer for pair of CRS
+
+        :param source_crs: Source CRS, i.e. 'epsg:4326'
+        :type source_crs: str
+
+        :param dest_crs: Destination CRS, i.e. 'epsg:3857'
+        :type dest_crs: str
+
+        :return: pyproj Transformer (or pair of Proj for old pyproj)
+        """
+        key = (str(source_crs).lower(), str(dest_crs).lower())
+        transformer = cls.__transformers.get(key)
+        if transformer is None:
+            with cls.__transformers_lock:
+                transformer = cls.__transformers.get(key)
+                if transformer is None:
+                    pyproj = cls.get_pyproj()
+                    if pyproj['Transformer'] is not None:
+                        transformer = pyproj['Transformer'].from_crs(key[0], key[1], always_xy=True)
+                    else:
+                        transformer = (pyproj['Proj'](init=key[0]), pyproj['Proj'](init=key[1]))
+                    cls.__transformers[key] = transformer
+        return transformer
+
+    @classmethod
+    def is_same_crs(cls, source_crs, dest_crs):
+        return str(source_crs).lower() == str(dest_crs).lower()
+
+    @classmethod
+    def transform_points(cls, xs, ys, source_crs, dest_crs):
+        """
+        Transform arrays of coordinates in one call
+
+        :param xs: X coordinates (longitudes for geographic CRS)
+        :type xs: list or numpy.ndarray
+
+        :param ys: Y coordinates (latitudes for geographic CRS)
+        :type ys: list or numpy.ndarray
+
+        :return: tuple of transformed xs and ys
+        """
+        if cls.is_same_crs(source_crs, dest_crs) or not len(xs):
+            return xs, ys
+
+        transformer = cls.get_transformer(source_crs, dest_crs)
+        pyproj = cls.get_pyproj()
+        if pyproj['Transformer'] is not None:
+            return transformer.transform(xs, ys)
+        return pyproj['transform'](transformer[0], transformer[1], xs, ys)
+
+    @classmethod
+    def transform_coordinates(cls, coordinates, source_crs, dest_crs):
+        """
+        Transform sequence of (x, y) pairs, i.e. polygon ring
+
+        :param coordinates: Sequence of (x, y) tuples
+        :type coordinates: list
+
+        :return: list of transformed (x, y) tuples
+        """
+        if cls.is_same_crs(source_crs, dest_crs) or not coordinates:
+            return list(coordinates)
+
+        xs, ys = cls.transform_points([xy[0] for xy in coordinates], [xy[1] for xy in coordinates], source_crs, dest_crs)
+        return list(zip(xs, ys))
@@ -0,0 +1,230 @@
+# coding=utf-8
+
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
+
+
+class MT_transport():
+    """
+    HTTP transport shared by MarineTraffic and NextGIS Web calls.
+
+    Keeps one pooled keep-alive Session per host, applies timeouts to every request
+    and retries failed requests with exponential backoff and jitter.
+
+    Retried are:
+    1. Responses with status from retry_statuses (429 and 5xx by default). 429 is retried for any method,
+    5xx only for idempotent methods (retry_methods), so POST of new feature is never sent twice.
+    2. Connection errors and timeouts for idempotent methods.
+
+    For 429 and 503 responses Retry-After header is respected (but not longer than backoff_max).
+
+    If metrics (MT_metrics) is set, requests, retries and errors are counted by method and host.
+    """
+
+    default_timeout = (10, 60)  # Connect and read timeouts in seconds
+    default_retries = 3
+    default_backoff_factor = 0.5  # In seconds
+    default_backoff_max = 60      # In seconds
+    retry_statuses = (429, 500, 502, 503, 504)
+    retry_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+    metrics = None
+
+    def __init__(self, timeout=None, retries=None, backoff_factor=None, backoff_max=None,
+                 pool_connections=4, pool_maxsize=16):
+        """
+        :param timeout: Timeout in seconds, number or (connect, read) tuple
+        :type timeout: float or tuple
+
+        :param retries: Number of retries after first failed attempt
+        :type retries: int
+
+        :param backoff_factor: Base delay in seconds, delay before n-th retry is about backoff_factor * 2^n
+        :type backoff_factor: float
+
+        :param backoff_max: Maximal delay between retries in seconds
+        :type backoff_max: float
+
+        :param pool_connections: Number of connection pools per session
+        :type pool_connections: int
+
+        :param pool_maxsize: Maximal number of kept-alive connections per host
+        :type pool_maxsize: int
+        """
+        self.timeout = timeout if timeout is not None else self.default_timeout
+        self.retries = retries if retries is not None else self.default_retries
+        self.backoff_factor = backoff_factor if backoff_factor is not None else self.default_backoff_factor
+        self.backoff_max = backoff_max if backoff_max is not None else self.default_backoff_max
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+
+        self.sessions = {}
+        self.__sessions_lock = threading.Lock()
+
+    def get_session(self, url):
+        """
+        Pooled session for host of url. Sessions are created on first use.
+
+        :return: requests.Session
+        """
+        parsed_url = urlparse(url)
+        host = '%s://%s' % (parsed_url.scheme, parsed_url.netloc)
+
+        with self.__sessions_lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[host] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Perform request through pooled session with timeout and retries.
+        Arguments are the same as for requests.request
+
+        :return: requests.Response (the last one, if all retries failed with retryable status)
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.get_session(url)
+        idempotent = method in self.retry_methods
+        host = urlparse(url).netloc
+
+        attempt = 0
+        while True:
+            if self.metrics is not None:
+                self.metrics.increment('http_requests', method=method, host=host)
+                if attempt:
+                    self.metrics.increment('http_retries', method=method, host=host)
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt >= self.retries:
+                    if self.metrics is not None:
+                        self.metrics.increment('http_errors', method=method, host=host)
+                    raise
+                time.sleep(self.__backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            retryable = response.status_code == 429 or (idempotent and response.status_code in self.retry_statuses)
+            if not retryable or attempt >= self.retries:
+                if self.metrics is not None and response.status_code >= 400:
+                    self.metrics.increment('http_errors', method=method, host=host)
+                return response
+
+            # Response is not needed anymore, connection is returned to pool (important for streamed responses)
+            response.close()
+            time.sleep(self.__backoff_delay(attempt, response.headers.get('Retry-After')))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        with self.__sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    def __backoff_delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_factor * (2 ** attempt), self.backoff_max)
+        # Half of delay is fixed and half is random, so clients do not retry at the same moment
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+class MT_request_coalescer():
+    """
+    Deduplication of identical requests of several monitors sharing one process (see MT_runner).
+
+    Request with the same key as request in flight waits for it and gets the same result instead of
+    being sent again. Result is also reused by requests with the same key made within max_age seconds
+    after it was received, but never by the same consumer twice (next poll of monitor gets fresh response).
+    Failed requests are not reused, error is raised for all waiting callers.
+    """
+
+    metrics = None
+
+    def __init__(self, max_age=5):
+        """
+        :param max_age: Time in seconds to reuse received result
+        :type max_age: float
+        """
+        self.max_age = max_age
+        self.stats = {'requests': 0, 'shared': 0}
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key, fetch, consumer=None):
+        """
+        :param key: Identity of request, i.e. URL
+        :type key: str
+
+        :param fetch: Function performing request, its result must not be consumed by callers (i.e. list, not generator)
+
+        :param consumer: Object making request, i.e. monitor
+
+        :return: result of fetch
+        """
+        with self.__lock:
+            self.__evict()
+            entry = self.__entries.get(key)
+            if entry is not None and entry['done'].is_set() and id(consumer) in entry['consumers']:
+                entry = None
+            owner = entry is None
+            if owner:
+                entry = {'done': threading.Event(), 'result': None, 'error': None, 'finish_time': None, 'consumers': set()}
+                self.__entries[key] = entry
+                self.stats['requests'] += 1
+            else:
+                self.stats['shared'] += 1
+                if self.metrics is not None:
+                    self.metrics.increment('shared_requests')
+            entry['consumers'].add(id(consumer))
+
+        if owner:
+            try:
+                entry['result'] = fetch()
+            except Exception as e:
+                entry['error'] = e
+                with self.__lock:
+                    if self.__entries.get(key) is entry:
+                        del self.__entries[key]
+            finally:
+                entry['finish_time'] = time.time()
+                entry['done'].set()
+        else:
+            entry['done'].wait()
+
+        if entry['error'] is not None:
+            raise entry['error']
+        return entry['result']
+
+    def __evict(self):
+        min_finish_time = time.time() - self.max_age
+        for key, entry in list(self.__entries.items()):
+            if entry['done'].is_set() and entry['finish_time'] < min_finish_time:
+                del self.__entries[key]
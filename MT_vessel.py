@@ -0,0 +1,147 @@
+# coding=utf-8
+
+import sys
+
+if sys.version_info[0] >= 3:
+    intern = sys.intern
+
+
+class MT_vessel(object):
+    """
+    Compact record of one vessel position.
+
+    Numeric fields are parsed once, when response is received, and kept as typed attributes
+    (lat, lon as float; speed, heading, course, status, utc_seconds as int). Repeated short strings
+    (DSRC, TIMESTAMP) are interned.
+
+    For compatibility record also works as dict with MarineTraffic field names and string values:
+    vessel['LAT'], vessel.get('SHIP_ID'), vessel['NEW'] = True, vessel.as_dict().
+    Absent fields are None.
+    """
+
+    fields = ('LAT', 'LON', 'SHIP_ID', 'MMSI', 'IMO', 'SPEED', 'HEADING', 'COURSE', 'STATUS',
+              'TIMESTAMP', 'DSRC', 'UTC_SECONDS', 'NEW', 'REQUEST_TIME')
+    float_fields = ('LAT', 'LON')
+    int_fields = ('SPEED', 'HEADING', 'COURSE', 'STATUS', 'UTC_SECONDS')
+    interned_fields = ('TIMESTAMP', 'DSRC', 'REQUEST_TIME')
+
+    __slots__ = ('lat', 'lon', 'ship_id', 'mmsi', 'imo', 'speed', 'heading', 'course', 'status',
+                 'timestamp', 'dsrc', 'utc_seconds', 'new', 'request_time', 'extra')
+
+    def __init__(self, record=None):
+        """
+        :param record: Vessel as dict from MarineTraffic API response
+        :type record: dict
+        """
+        for slot in self.__slots__:
+            setattr(self, slot, None)
+        if record:
+            for name, value in record.items():
+                self[name] = value
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        :param records: Vessels as list of dicts from MarineTraffic API response
+        :type records: list
+
+        :return: list of MT_vessel
+        """
+        return [record if isinstance(record, cls) else cls(record) for record in records]
+
+    @property
+    def key(self):
+        return self.ship_id or self.mmsi
+
+    def __setitem__(self, name, value):
+        slot = name.lower()
+        if name in self.fields:
+            if name in self.float_fields:
+                value = self.__parse_number(value, float)
+            elif name in self.int_fields:
+                value = self.__parse_number(value, int)
+            elif name in self.interned_fields and type(value) is str:
+                value = intern(value)
+            setattr(self, slot, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+
+    def __getitem__(self, name):
+        if name in self.fields:
+            value = getattr(self, name.lower())
+            if isinstance(value, float):
+                return repr(value)
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, int):
+                return str(value)
+            return value
+        if self.extra is not None and name in self.extra:
+            return self.extra[name]
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self.fields or (self.extra is not None and name in self.extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, MT_vessel):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        names = list(self.fields)
+        if self.extra:
+            names.extend(self.extra.keys())
+        return names
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def as_dict(self):
+        """
+        Dict view of record with string values as in MarineTraffic API response (plus NEW and REQUEST_TIME)
+        """
+        return dict(self.items())
+
+    def get_string(self, name):
+        """
+        Field value as string (None for absent fields), i.e. for OGR string fields
+        """
+        value = self.get(name)
+        return None if value is None else str(value)
+
+    @staticmethod
+    def __parse_number(value, number_type):
+        if value is None or value == '':
+            return None
+        try:
+            return number_type(value)
+        except (TypeError, ValueError):
+            pass
+        # Non-integer or malformed values are kept as they are
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return value
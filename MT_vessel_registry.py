@@ -0,0 +1,134 @@
+# coding=utf-8
+
+import os
+import json
+import time
+from collections import OrderedDict
+
+
+class MT_vessel_registry():
+    """
+    Registry of vessels seen by monitor, keyed by SHIP_ID (MMSI if SHIP_ID is absent).
+
+    Holds last seen time and position of every vessel. Vessels not seen longer than ttl are evicted,
+    so memory stays bounded. Registry could be snapshotted to JSON file and restored after restart.
+    """
+
+    default_ttl = 60             # In minutes
+    default_snapshot_period = 5  # In minutes
+
+    def __init__(self, ttl=None, snapshot_file=None, snapshot_period=None):
+        """
+        :param ttl: Time in minutes after which unseen vessel is forgotten (and will be NEW again)
+        :type ttl: int
+
+        :param snapshot_file: Path to JSON file for registry snapshots. If exists, registry is restored from it
+        :type snapshot_file: str
+
+        :param snapshot_period: Minimal time in minutes between snapshots
+        :type snapshot_period: int
+        """
+        self.ttl = ttl if ttl is not None else self.default_ttl
+        self.snapshot_file = snapshot_file
+        self.snapshot_period = snapshot_period if snapshot_period is not None else self.default_snapshot_period
+        self.last_snapshot_time = 0
+
+        # Entries are kept in order of last sighting, so the oldest are always at the beginning
+        self.vessels = OrderedDict()
+
+        if self.snapshot_file and os.path.exists(self.snapshot_file):
+            self.load(self.snapshot_file)
+
+    def __len__(self):
+        return len(self.vessels)
+
+    def __contains__(self, vessel_key):
+        return vessel_key in self.vessels
+
+    def register(self, vessel, seen_time=None):
+        """
+        Put vessel to registry (or refresh its entry)
+
+        :param vessel: Vessel record
+        :type vessel: MT_vessel
+
+        :param seen_time: Unix time of sighting, now by default
+        :type seen_time: float
+
+        :return: True if vessel was not known to registry (NEW), else False
+        """
+        if seen_time is None:
+            seen_time = time.time()
+
+        key = vessel.key
+        is_new = self.vessels.pop(key, None) is None
+        # Entry is a tuple (last seen time, lat, lon, timestamp) to keep registry compact
+        self.vessels[key] = (seen_time, vessel.lat, vessel.lon, vessel.timestamp)
+        return is_new
+
+    def is_known_position(self, vessel):
+        """
+        :return: True if vessel is in registry with the same TIMESTAMP (position was already received)
+        """
+        entry = self.vessels.get(vessel.key)
+        return entry is not None and vessel.timestamp is not None and entry[3] == vessel.timestamp
+
+    def get(self, vessel_key):
+        """
+        :return: dict with last_seen, LAT, LON, TIMESTAMP of vessel or None for unknown vessel
+        """
+        entry = self.vessels.get(vessel_key)
+        if entry is None:
+            return None
+        return {'last_seen': entry[0], 'LAT': entry[1], 'LON': entry[2], 'TIMESTAMP': entry[3]}
+
+    def evict(self, current_time=None):
+        """
+        Remove vessels not seen longer than ttl
+
+        :return: number of evicted vessels
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        expiration_time = current_time - self.ttl * 60.0
+        evicted = 0
+        while self.vessels:
+            key = next(iter(self.vessels))
+            if self.vessels[key][0] >= expiration_time:
+                break
+            del self.vessels[key]
+            evicted += 1
+        return evicted
+
+    def save(self, snapshot_file=None):
+        """
+        Write registry snapshot to JSON file. File is replaced atomically.
+        """
+        snapshot_file = snapshot_file or self.snapshot_file
+        temp_file = '%s.tmp' % snapshot_file
+        with open(temp_file, 'w') as fl:
+            json.dump({'ttl': self.ttl, 'vessels': list(self.vessels.items())}, fl)
+        if os.path.exists(snapshot_file) and os.name == 'nt':
+            os.remove(snapshot_file)
+        os.rename(temp_file, snapshot_file)
+        self.last_snapshot_time = time.time()
+
+    def save_if_due(self):
+        """
+        Write snapshot if snapshot file is set and snapshot_period passed since last one
+        """
+        if self.snapshot_file and time.time() - self.last_snapshot_time >= self.snapshot_period * 60.0:
+            self.save()
+
+    def load(self, snapshot_file=None):
+        """
+        Restore registry from JSON snapshot. Expired entries are dropped.
+        """
+        snapshot_file = snapshot_file or self.snapshot_file
+        with open(snapshot_file) as fl:
+            snapshot = json.load(fl)
+
+        entries = sorted(snapshot['vessels'], key=lambda item: item[1][0])
+        self.vessels = OrderedDict((key, tuple(entry)) for key, entry in entries)
+        self.evict()
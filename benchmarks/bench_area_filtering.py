@@ -0,0 +1,66 @@
+# coding=utf-8
+
+"""
+Comparison of scalar and vectorized filtering of vessels by monitoring areas.
+
+Usage: python benchmarks/bench_area_filtering.py [monitoring_area_source]
+"""
+
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from MTMonitor import MTMonitor
+from MT_area_index import VECTORIZED_FILTERING_AVAILABLE
+from MT_vessel import MT_vessel
+
+VESSEL_COUNTS = [1000, 10000, 100000]
+REPEATS = 3
+
+
+def generate_vessels(count, bounds):
+    vessels = []
+    for i in range(count):
+        vessels.append(MT_vessel({'SHIP_ID': str(i), 'MMSI': str(200000000 + i),
+                        'LON': str(random.uniform(bounds['x_min'], bounds['x_max'])),
+                        'LAT': str(random.uniform(bounds['y_min'], bounds['y_max'])),
+                        'TIMESTAMP': '2018-04-06T16:43:58'}))
+    return vessels
+
+
+def best_time(function, *args):
+    best = None
+    for i in range(REPEATS):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    random.seed(0)
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', '1694.geojson')
+    monitor = MTMonitor('', monitoring_area_source=source, log_file=os.devnull)
+    area_index = monitor.area_index
+
+    bounds = {'x_min': min(area['bounds']['x_min'] for area in monitor.monitoring_areas),
+              'x_max': max(area['bounds']['x_max'] for area in monitor.monitoring_areas),
+              'y_min': min(area['bounds']['y_min'] for area in monitor.monitoring_areas),
+              'y_max': max(area['bounds']['y_max'] for area in monitor.monitoring_areas)}
+
+    print('Areas: %s, vectorized filtering available: %s' % (len(area_index), VECTORIZED_FILTERING_AVAILABLE))
+    print('%10s %12s %12s %10s' % ('vessels', 'scalar, s', 'vector, s', 'speedup'))
+    for count in VESSEL_COUNTS:
+        vessels = generate_vessels(count, bounds)
+        scalar = best_time(area_index.filter_vessels, vessels, False)
+        vector = best_time(area_index.filter_vessels, vessels, True)
+        assert area_index.filter_vessels(vessels, False) == area_index.filter_vessels(vessels, True)
+        print('%10s %12.4f %12.4f %10.1f' % (count, scalar, vector, scalar / vector if vector else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# coding=utf-8
+
+"""
+End-to-end benchmark of polling and exports against local MarineTraffic and NextGIS Web stand-ins.
+
+For every combination of mode, vessel count and area count it measures time of stages
+(poll = get_vessels, export_file = export_vessels_to_file, export_web = export_vessels_to_web in sync mode),
+end-to-end time of cycle, peak of Python memory allocations and number of requests per poll.
+Results are printed and written as JSON. With --baseline results are compared with previous JSON.
+
+Usage: python benchmarks/bench_end_to_end.py [--vessels 1000,10000] [--areas 1,16] [--modes Predefined,Custom]
+                                             [--repeats 3] [--mt-latency 0.05] [--ngw-latency 0.01]
+                                             [--error-rate 0] [--output results.json] [--baseline old_results.json]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fiona
+from fiona.crs import from_epsg
+from MTMonitor import MTMonitor
+from MT_NGW_init_schemes import MT_NGW_init_schemes
+from MT_transport import MT_transport
+from MT_traffic_simulator import MT_traffic_simulator
+from MT_area_index import VECTORIZED_FILTERING_AVAILABLE
+from stand_ins import MarineTrafficStandIn, NextGISWebStandIn
+
+STAGES = ['poll', 'export_file', 'export_web']
+
+
+def write_areas(path, count, bounds):
+    # Areas are squares of regular grid over bounds
+    columns = int(math.ceil(math.sqrt(count)))
+    rows = int(math.ceil(count / float(columns)))
+    width = (bounds['x_max'] - bounds['x_min']) / columns
+    height = (bounds['y_max'] - bounds['y_min']) / rows
+    schema = {'geometry': 'Polygon', 'properties': {'id': 'int'}}
+    with fiona.open(path, 'w', driver='GeoJSON', schema=schema, crs=from_epsg(4326)) as output:
+        for number in range(count):
+            x = bounds['x_min'] + (number % columns) * width
+            y = bounds['y_min'] + (number // columns) * height
+            ring = [(x, y), (x + width * 0.9, y), (x + width * 0.9, y + height * 0.9), (x, y + height * 0.9), (x, y)]
+            output.write({'geometry': {'type': 'Polygon', 'coordinates': [ring]}, 'properties': {'id': number}})
+
+
+def summarize(values):
+    values = sorted(values)
+    return {'min': values[0], 'median': values[len(values) // 2], 'max': values[-1]}
+
+
+def run_scenario(options, mode, vessels_count, areas_count, work_dir):
+    bounds = MT_traffic_simulator.default_bounds
+    simulator = MT_traffic_simulator(vessels_count, bounds=bounds, seed=options.seed)
+    mt_stand_in = MarineTrafficStandIn(simulator, latency=options.mt_latency, error_rate=options.error_rate, seed=options.seed)
+    # Stand-in keeps only fields of vessel layer created by init_NGW_resource_for_vessels, as NGW does
+    layer_fields = [field['keyname'] for field in
+                    json.loads(MT_NGW_init_schemes(0, 'Vessels', 'vessels').get_init_vector_layer())['vector_layer']['fields']]
+    ngw_stand_in = NextGISWebStandIn(fields=layer_fields, latency=options.ngw_latency, error_rate=options.error_rate,
+                                     seed=options.seed)
+    mt_stand_in.start()
+    ngw_stand_in.start()
+
+    try:
+        areas_file = os.path.join(work_dir, 'areas_%s.geojson' % areas_count)
+        if not os.path.exists(areas_file):
+            write_areas(areas_file, areas_count, bounds)
+        transport = MT_transport(backoff_factor=0.01, backoff_max=0.1)
+        monitor = MTMonitor('benchmark', mode=mode, monitoring_area_source=areas_file, log_file=os.devnull, transport=transport)
+        monitor.MT_API_gate = mt_stand_in.gate
+        ngw_options = {'url': ngw_stand_in.url, 'user': 'benchmark', 'password': 'benchmark', 'resource_id': 1}
+        output_file = os.path.join(work_dir, 'vessels.%s' % options.output_type.lower().replace(' ', '_'))
+
+        def run_cycle():
+            durations = {}
+            start = time.time()
+            vessels = monitor.get_vessels(time_period=options.time_period)
+            durations['poll'] = time.time() - start
+            stage_start = time.time()
+            monitor.export_vessels_to_file(output_file, output_type=options.output_type, write_mode='rewrite', vessels=vessels)
+            durations['export_file'] = time.time() - stage_start
+            stage_start = time.time()
+            monitor.export_vessels_to_web(ngw_options, 'sync', vessels=vessels)
+            durations['export_web'] = time.time() - stage_start
+            durations['end_to_end'] = time.time() - start
+            return durations, len(vessels)
+
+        stage_times = dict((stage, []) for stage in STAGES + ['end_to_end'])
+        received = []
+        mt_requests = []
+        ngw_requests = []
+        for repeat in range(options.repeats):
+            with mt_stand_in.lock:
+                simulator.advance(60)
+            mt_stand_in.reset_counters()
+            ngw_stand_in.reset_counters()
+            durations, received_count = run_cycle()
+            for stage, duration in durations.items():
+                stage_times[stage].append(duration)
+            received.append(received_count)
+            mt_requests.append(mt_stand_in.get_requests_count())
+            ngw_requests.append(ngw_stand_in.get_requests_count())
+
+        # Memory is measured in separate cycle, tracing slows everything down
+        peak_memory = None
+        if tracemalloc is not None:
+            with mt_stand_in.lock:
+                simulator.advance(60)
+            tracemalloc.start()
+            run_cycle()
+            peak_memory = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+            tracemalloc.stop()
+
+        return {'mode': mode,
+                'vessels': vessels_count,
+                'areas': areas_count,
+                'received_vessels': summarize(received)['median'],
+                'stages': dict((stage, summarize(times)) for stage, times in stage_times.items() if stage != 'end_to_end'),
+                'end_to_end': summarize(stage_times['end_to_end']),
+                'peak_memory_mb': peak_memory,
+                'mt_requests_per_poll': float(sum(mt_requests)) / len(mt_requests),
+                'ngw_requests_per_poll': float(sum(ngw_requests)) / len(ngw_requests)}
+    finally:
+        mt_stand_in.stop()
+        ngw_stand_in.stop()
+
+
+def compare_with_baseline(results, baseline_file):
+    with open(baseline_file) as fl:
+        baseline = json.load(fl)
+    baseline_results = dict(((result['mode'], result['vessels'], result['areas']), result) for result in baseline['results'])
+
+    print('')
+    print('Comparison with %s (median end-to-end time, ratio > 1 is slower)' % baseline_file)
+    print('%10s %10s %7s %12s %12s %8s' % ('mode', 'vessels', 'areas', 'baseline, s', 'current, s', 'ratio'))
+    for result in results:
+        old_result = baseline_results.get((result['mode'], result['vessels'], result['areas']))
+        if old_result is None:
+            continue
+        old_time = old_result['end_to_end']['median']
+        new_time = result['end_to_end']['median']
+        print('%10s %10s %7s %12.4f %12.4f %8.2f' % (result['mode'], result['vessels'], result['areas'],
+                                                     old_time, new_time, new_time / old_time if old_time else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark with local MarineTraffic and NextGIS Web stand-ins')
+    parser.add_argument('--vessels', default='1000,10000,100000', help='Comma separated numbers of simulated vessels')
+    parser.add_argument('--areas', default='1,16', help='Comma separated numbers of monitoring areas')
+    parser.add_argument('--modes', default='Predefined,Custom', help='Comma separated modes')
+    parser.add_argument('--repeats', type=int, default=3, help='Measured cycles per scenario')
+    parser.add_argument('--time-period', type=int, default=5, help='time_period of polls in minutes')
+    parser.add_argument('--mt-latency', type=float, default=0.05, help='Latency of MarineTraffic stand-in in seconds')
+    parser.add_argument('--ngw-latency', type=float, default=0.01, help='Latency of NextGIS Web stand-in in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of failed requests of both stand-ins')
+    parser.add_argument('--output-type', default='GPKG', help='Fiona driver of file export')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of traffic simulation')
+    parser.add_argument('--output', default='bench_end_to_end.json', help='Path to JSON with results')
+    parser.add_argument('--baseline', help='Path to JSON with previous results for comparison')
+    options = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mt_benchmark_')
+    results = []
+    try:
+        print('%10s %10s %7s %9s %9s %11s %10s %11s %9s %8s %8s' % ('mode', 'vessels', 'areas', 'received', 'poll, s',
+                                                                    'to file, s', 'to NGW, s', 'e2e, s', 'peak, MB',
+                                                                    'MT req', 'NGW req'))
+        for mode in options.modes.split(','):
+            for vessels_count in [int(value) for value in options.vessels.split(',')]:
+                for areas_count in [int(value) for value in options.areas.split(',')]:
+                    result = run_scenario(options, mode, vessels_count, areas_count, work_dir)
+                    results.append(result)
+                    print('%10s %10s %7s %9s %9.4f %11.4f %10.4f %11.4f %9s %8.1f %8.1f' % (
+                        mode, vessels_count, areas_count, result['received_vessels'],
+                        result['stages']['poll']['median'], result['stages']['export_file']['median'],
+                        result['stages']['export_web']['median'], result['end_to_end']['median'],
+                        '%.1f' % result['peak_memory_mb'] if result['peak_memory_mb'] is not None else '-',
+                        result['mt_requests_per_poll'], result['ngw_requests_per_poll']))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'environment': {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'vectorized_filtering': VECTORIZED_FILTERING_AVAILABLE},
+              'parameters': vars(options),
+              'results': results}
+    with open(options.output, 'w') as fl:
+        json.dump(report, fl, indent=2, sort_keys=True)
+    print('Results written to %s' % options.output)
+
+    if options.baseline:
+        compare_with_baseline(results, options.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# coding=utf-8
+
+"""
+Startup benchmark: time of importing MTMonitor and of one-shot runs in fresh interpreters.
+
+Every scenario is run in new Python process several times (first run is not measured), median time
+is reported after subtraction of bare interpreter startup. Heavy optional backends (fiona, shapely, pyproj, numpy)
+loaded by scenario are listed too. Core scenarios (import, poll without areas) must not load any of them.
+
+Exit code is 1 if core scenario loads heavy backend or import of MTMonitor takes longer than --max-import-ms,
+so benchmark could be run in CI to keep startup from regressing.
+
+Usage: python benchmarks/bench_import_time.py [--repeats 7] [--max-import-ms 500] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import shutil
+import tempfile
+import subprocess
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ['fiona', 'shapely', 'pyproj', 'numpy']
+
+SETUP = 'import os, sys; sys.path.insert(0, %r)\n' % ROOT
+REPORT = 'import json; print(json.dumps([name for name in %r if name in sys.modules]))\n' % HEAVY_MODULES
+
+AREAS_SOURCE = os.path.join(ROOT, 'data', '1694.geojson')
+# Scenario name: (code, is core scenario), %(cache_dir)r is replaced with directory of areas cache
+SCENARIOS = [
+    ('import', 'import MTMonitor\n', True),
+    ('poll_without_areas', 'from MTMonitor import MTMonitor\n'
+                           'monitor = MTMonitor("key", log_file=os.devnull)\n'
+                           'monitor.get_vessels(emulation=True)\n', True),
+    ('poll_with_areas', 'from MTMonitor import MTMonitor\n'
+                        'monitor = MTMonitor("key", monitoring_area_source=%r, log_file=os.devnull)\n'
+                        'monitor.get_vessels(emulation=True)\n' % AREAS_SOURCE, False),
+    # Areas are read from cache, so only geometry backend is needed, not Fiona and pyproj
+    ('poll_with_cached_areas', 'from MTMonitor import MTMonitor\n'
+                               'monitor = MTMonitor("key", monitoring_area_source=%r, area_cache_dir=%%(cache_dir)r, '
+                               'log_file=os.devnull)\n'
+                               'monitor.get_vessels(emulation=True)\n' % AREAS_SOURCE, False),
+]
+
+
+def run_code(code):
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    duration = time.time() - start
+    lines = output.decode('utf-8').strip().splitlines()
+    return duration, json.loads(lines[-1]) if lines else []
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of MTMonitor in fresh interpreters')
+    parser.add_argument('--repeats', type=int, default=7, help='Runs per scenario')
+    parser.add_argument('--max-import-ms', type=float, default=500, help='Limit of import MTMonitor time in milliseconds')
+    parser.add_argument('--output', help='Path to JSON with results')
+    options = parser.parse_args()
+
+    interpreter_time = median([run_code('print("[]")')[0] for repeat in range(options.repeats)])
+    print('Interpreter startup: %.1f ms' % (interpreter_time * 1000))
+    print('%22s %12s  %s' % ('scenario', 'time, ms', 'heavy modules loaded'))
+
+    results = []
+    failures = []
+    cache_dir = tempfile.mkdtemp(prefix='mt_import_benchmark_')
+    try:
+        for name, code, core in SCENARIOS:
+            code = SETUP + code.replace('%(cache_dir)r', repr(cache_dir)) + REPORT
+            run_code(code)
+            durations = []
+            loaded = []
+            for repeat in range(options.repeats):
+                duration, loaded = run_code(code)
+                durations.append(duration)
+            results.append(check_scenario(options, name, core, median(durations) - interpreter_time, loaded, failures))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if options.output:
+        with open(options.output, 'w') as fl:
+            json.dump({'interpreter_ms': interpreter_time * 1000, 'results': results}, fl, indent=2, sort_keys=True)
+        print('Results written to %s' % options.output)
+
+    for failure in failures:
+        print('FAILED: %s' % failure)
+    return 1 if failures else 0
+
+
+def check_scenario(options, name, core, duration, loaded, failures):
+    scenario_time = max(duration, 0) * 1000
+    print('%22s %12.1f  %s' % (name, scenario_time, ', '.join(loaded) or '-'))
+    if core and loaded:
+        failures.append('%s loads %s' % (name, ', '.join(loaded)))
+    if name == 'import' and scenario_time > options.max_import_ms:
+        failures.append('import takes %.1f ms, limit is %.1f ms' % (scenario_time, options.max_import_ms))
+    return {'scenario': name, 'time_ms': scenario_time, 'heavy_modules': loaded, 'core': core}
+
+
+if __name__ == '__main__':
+    sys.exit(main())
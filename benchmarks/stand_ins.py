@@ -0,0 +1,210 @@
+# coding=utf-8
+
+"""
+Local HTTP stand-ins of MarineTraffic exportvessels and NextGIS Web feature API for benchmarks.
+
+Both servers run in background threads on 127.0.0.1, add configurable latency to every response,
+fail given share of requests (error_rate, with error_status) and count requests by method.
+"""
+
+import re
+import json
+import time
+import random
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandIn(object):
+    """
+    Base of stand-in server
+    """
+
+    def __init__(self, latency=0, error_rate=0, error_status=500, seed=None):
+        """
+        :param latency: Delay before every response in seconds
+        :param error_rate: Share of requests answered with error_status
+        :param error_status: HTTP status of injected errors
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.server = None
+
+    def start(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.dispatch(self, 'GET')
+
+            def do_POST(self):
+                stand_in.dispatch(self, 'POST')
+
+            def do_PUT(self):
+                stand_in.dispatch(self, 'PUT')
+
+            def do_PATCH(self):
+                stand_in.dispatch(self, 'PATCH')
+
+            def do_DELETE(self):
+                stand_in.dispatch(self, 'DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = {}
+
+    def get_requests_count(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def dispatch(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else None
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            failed = self.error_rate and self.random.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            self.send(handler, self.error_status, json.dumps({'error': 'Injected error'}).encode('utf-8'))
+            return
+        status, response_body = self.handle(method, handler.path, body)
+        self.send(handler, status, response_body)
+
+    def send(self, handler, status, body):
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+
+class MarineTrafficStandIn(StandIn):
+    """
+    MarineTraffic exportvessels endpoint, answering with positions of MT_traffic_simulator.
+
+    Serves paths of MTMonitor requests: <gate>/<key>/timespan:N/protocol:P (PS05) and
+    <gate>/<key>/MINLAT:../MAXLAT:../MINLON:../MAXLON:../timespan:N/protocol:P (PS06).
+    """
+
+    def __init__(self, simulator, **kwargs):
+        StandIn.__init__(self, **kwargs)
+        self.simulator = simulator
+
+    @property
+    def gate(self):
+        return '%s/api/exportvessels/v:8' % self.url
+
+    def handle(self, method, path, body):
+        options = dict(re.findall(r'(MINLAT|MAXLAT|MINLON|MAXLON|timespan|protocol):([^/]+)', path))
+        bounds = None
+        if 'MINLAT' in options:
+            bounds = {'y_min': float(options['MINLAT']), 'y_max': float(options['MAXLAT']),
+                      'x_min': float(options['MINLON']), 'x_max': float(options['MAXLON'])}
+        with self.lock:
+            vessels = self.simulator.get_payload(int(options.get('timespan', 0)) or None, bounds)
+
+        if options.get('protocol') == 'csv':
+            fields = ['MMSI', 'IMO', 'SHIP_ID', 'LAT', 'LON', 'SPEED', 'HEADING', 'COURSE', 'STATUS', 'TIMESTAMP',
+                      'DSRC', 'UTC_SECONDS']
+            lines = [','.join(fields)] + [','.join(vessel[field] for field in fields) for vessel in vessels]
+            return 200, ('\n'.join(lines) + '\n').encode('utf-8')
+        return 200, json.dumps(vessels).encode('utf-8')
+
+
+class NextGISWebStandIn(StandIn):
+    """
+    NextGIS Web api/resource/{id}/feature/ endpoint with features kept in memory.
+
+    GET returns all features, PATCH creates (and updates features with id) feature collection,
+    DELETE removes listed features (or all without body), POST creates one feature.
+    If layer fields are given, other fields are dropped and every feature has all layer fields, as in NGW.
+    """
+
+    def __init__(self, fields=None, **kwargs):
+        StandIn.__init__(self, **kwargs)
+        self.layer_fields = fields
+        self.features = {}
+        self.next_id = 1
+
+    def store_fields(self, feature, old_fields=None):
+        if self.layer_fields is None or 'fields' not in feature:
+            return feature
+        fields = dict((name, None) for name in self.layer_fields)
+        fields.update(old_fields or {})
+        fields.update((name, value) for name, value in feature['fields'].items() if name in fields)
+        return dict(feature, fields=fields)
+
+    def handle(self, method, path, body):
+        if not re.search(r'/api/resource/\d+/feature/?$', path.split('?')[0]):
+            return 404, json.dumps({'error': 'Not found'}).encode('utf-8')
+
+        data = json.loads(body.decode('utf-8')) if body else None
+        with self.lock:
+            if method == 'GET':
+                result = [dict(feature, id=feature_id) for feature_id, feature in self.features.items()]
+            elif method == 'PATCH':
+                result = []
+                for feature in data:
+                    feature_id = feature.get('id')
+                    if feature_id is None:
+                        feature_id = self.next_id
+                        self.next_id += 1
+                        self.features[feature_id] = self.store_fields(feature)
+                    else:
+                        old_feature = self.features.setdefault(feature_id, {})
+                        old_feature.update(self.store_fields(feature, old_feature.get('fields')))
+                    result.append({'id': feature_id})
+            elif method == 'POST':
+                result = {'id': self.next_id}
+                self.features[self.next_id] = self.store_fields(data)
+                self.next_id += 1
+            elif method == 'DELETE':
+                if data:
+                    for item in data:
+                        self.features.pop(item['id'], None)
+                else:
+                    self.features = {}
+                result = None
+            else:
+                return 405, json.dumps({'error': 'Method not allowed'}).encode('utf-8')
+        return 200, json.dumps(result).encode('utf-8')